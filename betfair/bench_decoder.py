@@ -0,0 +1,103 @@
+"""
+Microbenchmark of stream message decoding.
+
+Compares the previous decode path (json.loads plus repeated dict lookups per
+runner field) with StreamDecoder for every available json backend.
+
+Usage:
+    python -m betfair.bench_decoder [recorded_file] [--repeat N]
+
+recorded_file is a betfair.recorder recording, or a file with one raw stream
+payload per line. Without it, synthetic messages shaped like a busy pre-off
+market are used.
+"""
+import argparse
+import json
+import random
+import time
+
+from betfair.decoder import StreamDecoder, load_json_backend
+from betfair.recorder import read_recording
+
+
+def load_messages(path):
+    return [raw_data for _, raw_data in read_recording(path)]
+
+
+def synthetic_messages(count=5000, markets=30, runners=15):
+    messages = []
+    pt = 1700000000000
+    for _ in range(count):
+        pt += random.randint(1, 50)
+        market_changes = []
+        for market in random.sample(range(markets), 3):
+            runner_changes = []
+            for runner in random.sample(range(runners), random.randint(1, runners)):
+                price = round(random.uniform(1.5, 20), 1)
+                runner_changes.append({'id': 1000 + runner,
+                                       'atb': [[price, round(random.uniform(0, 500), 2)]],
+                                       'atl': [[price + 0.1, round(random.uniform(0, 500), 2)]],
+                                       'trd': [[price, round(random.uniform(0, 5000), 2)]]})
+            market_changes.append({'id': f'1.{200000000 + market}', 'rc': runner_changes})
+        messages.append(json.dumps({'op': 'mcm', 'id': 1, 'clk': 'AAAA', 'pt': pt, 'mc': market_changes}))
+    return messages
+
+
+def legacy_decode(raw_data):
+    """Field access pattern of the listener before StreamDecoder."""
+    data = json.loads(raw_data)
+    for market_change in data.get('mc', []):
+        market_id = market_change.get('id')
+        for runner_change in market_change.get('rc', []):
+            runner_id = str(runner_change.get('id'))
+            int(runner_id)
+            runner_change.get('atb')[0][0] if runner_change.get('atb') else None
+            runner_change.get('atl')[0][0] if runner_change.get('atl') else None
+            runner_change.get('trd')[0][0] if runner_change.get('trd') else None
+            runner_change.get('atb')[0][1] if runner_change.get('atb') else None
+            runner_change.get('atl')[0][1] if runner_change.get('atl') else None
+            runner_change.get('trd')[0][1] if runner_change.get('trd') else None
+        data.get('pt')
+    return market_id
+
+
+def decoder_decode(decoder):
+    def decode(raw_data):
+        message = decoder.decode(raw_data)
+        for market in message.markets:
+            for runner in market.runners:
+                runner.key, runner.atb, runner.atl, runner.trd  # pylint: disable=pointless-statement
+        return message
+    return decode
+
+
+def run(name, decode, messages, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for raw_data in messages:
+            decode(raw_data)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<24} {len(messages) / best:>12,.0f} msg/s  {best / len(messages) * 1e6:>8.2f} us/msg")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recorded_file', nargs='?')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    messages = load_messages(args.recorded_file) if args.recorded_file else synthetic_messages()
+    print(f"{len(messages)} messages, best of {args.repeat}")
+    run('legacy json + get()', legacy_decode, messages, args.repeat)
+    for backend in ('json', 'ujson', 'orjson'):
+        try:
+            load_json_backend(backend)
+        except ImportError:
+            print(f"{'decoder ' + backend:<24} not installed")
+            continue
+        run(f'decoder {backend}', decoder_decode(StreamDecoder(backend)), messages, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
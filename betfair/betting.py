@@ -3,7 +3,8 @@ import betfairlightweight
 import numpy as np
 from betfairlightweight import filters
 
-from betfair.config import client, tick_sizes
+from betfair.config import client
+from betfair.orderbook import tick_sizes
 
 # create trading instance
 trading = client
@@ -26,27 +27,36 @@ def price_adjustment(price):
     return round(price_ladder[i], 2)
 
 
-def place_order(market_id, selection_id, size, price, side='LAY', persistence_type='LAPSE'):
-    # placing an order
-    price=float(price)
+def limit_instruction(selection_id, size, price, side='LAY', persistence_type='LAPSE'):
     limit_order = filters.limit_order(
-        size=size, price=price, persistence_type=persistence_type)
-    instruction = filters.place_instruction(
+        size=size, price=float(price), persistence_type=persistence_type)
+    return filters.place_instruction(
         order_type="LIMIT",
         selection_id=selection_id,
         side=side,
         limit_order=limit_order,
     )
+
+
+def place_orders(market_id, instructions):
+    """One placeOrders call for several instructions on a market, returns its status and instruction reports."""
     place_orders = trading.betting.place_orders(
-        market_id=market_id, instructions=[instruction]  # list
+        market_id=market_id, instructions=instructions  # list
     )
-
     print(place_orders.status)
     for order in place_orders.place_instruction_reports:
         print(
             "Status: %s, BetId: %s, Average Price Matched: %s "
             % (order.status, order.bet_id, order.average_price_matched)
         )
+    return place_orders.status, place_orders.place_instruction_reports
+
+
+def place_order(market_id, selection_id, size, price, side='LAY', persistence_type='LAPSE'):
+    # placing an order
+    instruction = limit_instruction(selection_id, size, price, side=side, persistence_type=persistence_type)
+    _, reports = place_orders(market_id, [instruction])
+    order = reports[-1]
     return order.status, order.bet_id, order.average_price_matched
 
 
@@ -0,0 +1,190 @@
+"""Market start times and strategy window events on a timer wheel."""
+import time
+
+from betfair.subscriptions import strategy_window
+
+WHEEL_TICK_SECONDS = .1
+WHEEL_SLOTS = 1024
+WINDOW_BOUNDARY_DELAY = .001  # leave just after a window closes, its upper bound is inclusive
+
+# window event kinds
+ENTER = 'enter'
+LEAVE = 'leave'
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: timers hash to a slot by their tick, advancing visits
+    only the slots of the ticks that passed.
+
+    Timers further out than one rotation share slots with nearer ones and are
+    skipped until their tick comes. A timer never fires before its time, timers
+    added in the past fire on the next advance.
+
+    Args:
+        tick (float): seconds per slot
+        slots (int): slots per rotation
+        now (float): epoch seconds to start from
+
+    """
+
+    def __init__(self, tick=WHEEL_TICK_SECONDS, slots=WHEEL_SLOTS, now=None):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = int((time.time() if now is None else now) / tick)  # first tick not fully processed
+        self.count = 0
+
+    def add(self, when, item):
+        index = max(int(when / self.tick), self.current)
+        self.slots[index % len(self.slots)].append((index, when, item))
+        self.count += 1
+
+    def advance(self, now):
+        """Items of the timers due at now, in time order."""
+        target = int(now / self.tick)
+        if target < self.current:
+            return []
+        slot_count = len(self.slots)
+        if target - self.current >= slot_count:
+            slots = range(slot_count)  # a full rotation passed, every slot can have due timers
+        else:
+            slots = (tick % slot_count for tick in range(self.current, target + 1))
+        due = []
+        for slot in slots:
+            timers = self.slots[slot]
+            if not timers:
+                continue
+            keep = []
+            for timer in timers:
+                if timer[0] <= target and timer[1] <= now:
+                    due.append(timer)
+                else:
+                    keep.append(timer)
+            self.slots[slot] = keep
+        self.count -= len(due)
+        self.current = target  # the current tick can still have timers later in it
+        due.sort(key=lambda timer: timer[1])
+        return [item for _, _, item in due]
+
+    def next_due(self):
+        """Epoch seconds of the next timer, None if there is none."""
+        if not self.count:
+            return None
+        slot_count = len(self.slots)
+        for tick in range(self.current, self.current + slot_count):
+            timers = [when for index, when, _ in self.slots[tick % slot_count] if index == tick]
+            if timers:
+                return min(timers)
+        return min(when for timers in self.slots for _, when, _ in timers)
+
+
+class MarketTimes:
+    __slots__ = ('race', 'start', 'windows', 'generation')
+
+    def __init__(self, race, start, windows, generation):
+        self.race = race
+        self.start = start  # epoch seconds
+        self.windows = windows  # strategy key -> (enter, leave) epoch seconds
+        self.generation = generation
+
+
+def _window_key(strategies):
+    return tuple((name, strategy.get('active'), strategy.get('selectedSportType'), strategy.get('market_type'),
+                  strategy.get('harnessSelection'), tuple(strategy.get('selectedCountries', ())),
+                  tuple(strategy.get('secsToStartSlider') or ()))
+                 for name, strategy in strategies.items())
+
+
+class MarketClock:
+    """
+    Start times of the markets as epoch seconds and the windows in which the
+    active strategies can bet on them.
+
+    update() computes a market's windows when it is new, when its start time
+    moved or when the strategies' windows or filters changed, and puts an
+    enter and a leave timer per window on the wheel. due() returns the
+    (market id, strategy key, ENTER or LEAVE) events whose time has come,
+    timers of windows that were recomputed since are dropped.
+
+    Used from the event loop only.
+
+    """
+
+    def __init__(self, now=None):
+        self.wheel = TimerWheel(now=now)
+        self.on_timer = None  # called with the epoch seconds of every timer added
+        self._key = None
+        self._markets = {}  # market id -> MarketTimes
+        self._generation = 0
+
+    def update(self, race_dict, strategies, market_ids, now=None):
+        if now is None:
+            now = time.time()
+        key = _window_key(strategies)
+        if key != self._key:
+            self._key = key
+            self._markets = {}
+        for market_id in market_ids:
+            race = race_dict.get(market_id)
+            times = self._markets.get(market_id)
+            if race is None:
+                if times is not None:
+                    del self._markets[market_id]
+                continue
+            if times is not None and times.race is race:
+                continue
+            start = race['start_time'].timestamp()
+            if times is not None and times.start == start:
+                times.race = race  # metadata refresh, nothing the windows depend on changed
+                continue
+            self._generation += 1
+            windows = {}
+            for strategy_key, strategy in strategies.items():
+                window = strategy_window(strategy, race, start)
+                if window is not None:
+                    windows[strategy_key] = window
+            self._markets[market_id] = MarketTimes(race, start, windows, self._generation)
+            for strategy_key, (enter, leave) in windows.items():
+                if enter > now:
+                    self._add(enter, (market_id, self._generation, strategy_key, ENTER))
+                if leave >= now:
+                    self._add(leave + WINDOW_BOUNDARY_DELAY, (market_id, self._generation, strategy_key, LEAVE))
+
+    def _add(self, when, item):
+        self.wheel.add(when, item)
+        if self.on_timer is not None:
+            self.on_timer(when)
+
+    def due(self, now=None):
+        events = []
+        for market_id, generation, strategy_key, kind in self.wheel.advance(time.time() if now is None else now):
+            times = self._markets.get(market_id)
+            if times is not None and times.generation == generation:
+                events.append((market_id, strategy_key, kind))
+        return events
+
+    def next_event(self):
+        return self.wheel.next_due()
+
+    def prune(self, market_ids):
+        """Forget markets not in market_ids, their timers are dropped when due."""
+        for market_id in [market_id for market_id in self._markets if market_id not in market_ids]:
+            del self._markets[market_id]
+
+    def start(self, market_id):
+        times = self._markets.get(market_id)
+        return None if times is None else times.start
+
+    def seconds_to_start(self, market_id, now=None):
+        times = self._markets.get(market_id)
+        if times is None:
+            return None
+        return times.start - (time.time() if now is None else now)
+
+    def window(self, market_id):
+        """(first enter, last leave) of the strategy windows on a market, None if no strategy can bet on it."""
+        times = self._markets.get(market_id)
+        if times is None or not times.windows:
+            return None
+        return (min(enter for enter, _ in times.windows.values()),
+                max(leave for _, leave in times.windows.values()))
@@ -39,13 +39,12 @@ USERNAME = admin_data['BetfairLogin']
 # constants
 COUNTRIES = ['UK', 'US', 'AU', 'IE']
 MARKET_TYPES = ['WIN','PLACE']
-MAX_RACE_STREAMS = 30
+MAX_RACE_STREAMS = 200  # markets per market type, the catalogue limit with RUNNER_METADATA
 EVENT_TYPE_IDS = ['7','4339']
 KEEP_AFTER_RACE_START_MIN = 15
 HOURS_TO_FETCH = 8
 
 MARKET_FETCH_MINUTES = 2
-STREAM_RESTART_MINUTES = 2
 
 SERVER_NAMES = ['ip-172-31-35-26.ap-southeast-2.compute.internal']
 
@@ -72,15 +71,5 @@ def is_prod_computer():
     return socket.gethostname() in SERVER_NAMES
 
 
-tick_sizes = [(1.01, 2, 0.01),
-              (2.02, 3, 0.02),
-              (3.05, 4, 0.05),
-              (4.1, 6, 0.1),
-              (6.2, 10, 0.2),
-              (10.5, 20, 0.5),
-              (21, 30, 1.),
-              (32, 50, 2.),
-              (55, 100, 5.),
-              (110, 1000, 10.)]
-
-
+def computer_name():
+    return socket.gethostname()
@@ -0,0 +1,134 @@
+"""Selective decoding of market stream messages."""
+import importlib
+import logging
+
+log = logging.getLogger(__name__)
+
+JSON_BACKEND = 'auto'  # 'auto' picks the fastest installed of orjson, ujson, json
+
+
+def load_json_backend(name=JSON_BACKEND):
+    """Return (backend name, loads function) for a json backend."""
+    candidates = ('orjson', 'ujson', 'json') if name == 'auto' else (name,)
+    for candidate in candidates:
+        try:
+            module = importlib.import_module(candidate)
+        except ImportError:
+            if name != 'auto':
+                raise
+            continue
+        return candidate, module.loads
+    raise ImportError("No json backend available")
+
+
+class RunnerDelta:
+    """Reusable slot for the fields of one runner change."""
+
+    __slots__ = ('id', 'key', 'atb', 'atl', 'trd')
+
+    def __init__(self, selection_id):
+        self.id = selection_id
+        self.key = str(selection_id)  # runner key used by MarketState and snapshots
+        self.atb = None
+        self.atl = None
+        self.trd = None
+
+
+class MarketDelta:
+    """Reusable slot for one market change and its runner changes."""
+
+    __slots__ = ('id', 'img', 'definition', 'runners', 'runner_slots')
+
+    def __init__(self, market_id):
+        self.id = market_id
+        self.img = False
+        self.definition = None
+        self.runners = []
+        self.runner_slots = {}
+
+
+class StreamMessage:
+    __slots__ = ('op', 'ct', 'pt', 'clk', 'initial_clk', 'segment_type', 'markets',
+                 'status_code', 'error_code', 'error_message', 'connection_closed')
+
+    def __init__(self):
+        self.op = None
+        self.ct = None
+        self.pt = None
+        self.clk = None
+        self.initial_clk = None
+        self.segment_type = None
+        self.markets = []
+        # only set by status messages
+        self.status_code = None
+        self.error_code = None
+        self.error_message = None
+        self.connection_closed = False
+
+
+class StreamDecoder:
+    """
+    Decodes raw stream payloads into preallocated market and runner slots.
+
+    Only pt, clk, initialClk, segmentType and per market id, img,
+    marketDefinition and the runners' id, atb, atl and trd are extracted, once
+    per message. Status messages only get their status and error fields. Slots are
+    reused between messages, so the returned message is only valid until the
+    next call to decode.
+
+    """
+
+    def __init__(self, backend=JSON_BACKEND):
+        self.backend, self._loads = load_json_backend(backend)
+        log.info(f"Stream decoder using {self.backend}")
+        self._market_slots = {}
+        self._message = StreamMessage()
+
+    def decode(self, raw_data, market_ids=None):
+        """Decode a payload, markets not in market_ids (if given) are skipped."""
+        data = self._loads(raw_data)
+        message = self._message
+        message.op = data.get('op')
+        message.ct = data.get('ct')
+        message.pt = data.get('pt')
+        message.clk = data.get('clk')
+        message.initial_clk = data.get('initialClk')
+        message.segment_type = data.get('segmentType')
+        markets = message.markets
+        markets.clear()
+        if message.op == 'status':
+            message.status_code = data.get('statusCode')
+            message.error_code = data.get('errorCode')
+            message.error_message = data.get('errorMessage')
+            message.connection_closed = data.get('connectionClosed', False)
+            return message
+
+        for market_change in data.get('mc', ()):
+            market_id = market_change.get('id')
+            if market_ids is not None and market_id not in market_ids:
+                continue
+            market = self._market_slots.get(market_id)
+            if market is None:
+                market = self._market_slots[market_id] = MarketDelta(market_id)
+            market.img = market_change.get('img', False)
+            market.definition = market_change.get('marketDefinition')
+            runners = market.runners
+            runners.clear()
+            runner_slots = market.runner_slots
+            for runner_change in market_change.get('rc', ()):
+                selection_id = runner_change['id']
+                runner = runner_slots.get(selection_id)
+                if runner is None:
+                    runner = runner_slots[selection_id] = RunnerDelta(selection_id)
+                runner.atb = runner_change.get('atb')
+                runner.atl = runner_change.get('atl')
+                runner.trd = runner_change.get('trd')
+                runners.append(runner)
+            markets.append(market)
+        return message
+
+    def prune(self, market_ids):
+        """Drop the slots of markets not in market_ids, safe to call while another thread decodes."""
+        for market_id in list(self._market_slots):
+            if market_id not in market_ids:
+                self._market_slots.pop(market_id, None)
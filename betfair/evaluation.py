@@ -0,0 +1,339 @@
+"""Vectorised evaluation of strategy conditions over all streamed runners."""
+import math
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from betfair.features import BOOK_FEATURE_CONDITIONS
+
+# value status per runner and condition
+VALUE_OK = 0
+VALUE_MISSING = 1
+VALUE_NOT_A_NUMBER = 2
+
+# why a runner failed a strategy
+FAIL_MISSING = 1
+FAIL_NOT_A_NUMBER = 2
+FAIL_RANGE = 3
+
+HORSES_PER_RACE = 'Horses per race'
+# condition name -> runner snapshot field, always present
+RUNNER_CONDITIONS = {
+    'Last Traded price': 'last',
+    'Current lay price': 'lay',
+    'Current back price': 'back',
+    'Traded volume': 'volume',
+    'Recent traded volume': 'recent_volume',
+    'Traded VWAP': 'traded_vwap',
+}
+# condition name -> runner snapshot field, missing when the book side is empty
+FEATURE_CONDITIONS = {condition_name: field_name for field_name, condition_name in BOOK_FEATURE_CONDITIONS.items()}
+# condition name -> market snapshot field
+MARKET_CONDITIONS = {
+    'Last total odds': '_last_overrun',
+    'Back total odds': '_back_overrun',
+    'Lay total odds': '_lay_overrun',
+}
+
+
+def extract_real(value):
+    # If value is already a float or int, return it
+    if isinstance(value, (float, int)):
+        return value
+
+    # Extract only the digits and a single dot using regex
+    num_str = ''.join(re.findall(r'[0-9.]', value))
+
+    # Handle cases with multiple dots by keeping only the first one
+    parts = num_str.split('.')
+    if len(parts) > 2:
+        num_str = parts[0] + '.' + ''.join(parts[1:])
+
+    return float(num_str)
+
+
+def parse_condition_value(value):
+    """(number, VALUE_* status, is int) of a condition value, as extract_real sees it."""
+    value_type = type(value)
+    if value_type is float:
+        return value, VALUE_OK, False
+    if value_type is int:
+        return float(value), VALUE_OK, True
+    try:
+        return _parse_hashable(value)
+    except TypeError:  # unhashable, lru_cache can't take it
+        return _parse(value)
+
+
+@lru_cache(maxsize=65536, typed=True)
+def _parse_hashable(value):
+    return _parse(value)
+
+
+def _parse(value):
+    try:
+        number = extract_real(value)
+    except Exception:
+        return math.nan, VALUE_NOT_A_NUMBER, False
+    return float(number), VALUE_OK, isinstance(number, int)
+
+
+def is_horse_condition(name):
+    return (name != HORSES_PER_RACE and name not in RUNNER_CONDITIONS and name not in FEATURE_CONDITIONS
+            and name not in MARKET_CONDITIONS)
+
+
+class HorseFeatures:
+    """
+    Numeric vectors of the horse info conditions, parsed once per horse info dict.
+
+    The metadata refresh stores a new dict per horse, so a horse is parsed
+    again only after a refresh. Vectors are (values, status, is int) over the
+    horse columns of the matrix, conditions a horse has no value for have the
+    VALUE_MISSING status.
+
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.indices = [j for j, name in enumerate(columns) if is_horse_condition(name)]
+        self.names = [columns[j] for j in self.indices]
+        self.missing = (np.full(len(self.indices), np.nan), np.full(len(self.indices), VALUE_MISSING, dtype=np.int8),
+                        np.zeros(len(self.indices), dtype=bool))
+        self._vectors = {}  # horse name -> (horse info dict, vector)
+        self.parsed = 0
+
+    def vector(self, horse_info):
+        if not isinstance(horse_info, dict):
+            return self.missing
+        key = horse_info.get('Horse Name', id(horse_info))
+        cached = self._vectors.get(key)
+        if cached is not None and cached[0] is horse_info:
+            return cached[1]
+        values, status, is_int = (array.copy() for array in self.missing)
+        for k, name in enumerate(self.names):
+            if name in horse_info:
+                values[k], status[k], is_int[k] = parse_condition_value(horse_info[name])
+        vector = values, status, is_int
+        self._vectors[key] = (horse_info, vector)
+        self.parsed += 1
+        return vector
+
+
+class MarketBlock:
+    """Condition values of the runners of one market snapshot, in snapshot order."""
+
+    __slots__ = ('snapshot', 'runner_count', 'columns', 'keys', 'values', 'status', 'is_int', '_prices')
+
+    def __init__(self, snapshot, runner_count, columns, horse_features):
+        self.snapshot = snapshot
+        self.runner_count = runner_count
+        self.columns = columns
+        runners = snapshot.runners
+        market = snapshot.market
+        self.keys = list(runners)
+        shape = (len(runners), len(columns))
+        self.values = np.full(shape, np.nan)
+        self.status = np.zeros(shape, dtype=np.int8)
+        self.is_int = np.zeros(shape, dtype=bool)
+        self._prices = {}
+        stream_columns = [(j, name) for j, name in enumerate(columns) if not is_horse_condition(name)]
+        horse_indices = horse_features.indices
+        for i, runner in enumerate(runners.values()):
+            for j, name in stream_columns:
+                if name == HORSES_PER_RACE:
+                    value = runner_count
+                elif name in RUNNER_CONDITIONS:
+                    value = runner.get(RUNNER_CONDITIONS[name], 0.)
+                elif name in FEATURE_CONDITIONS:
+                    value = runner.get(FEATURE_CONDITIONS[name])
+                    if value is None or value != value:
+                        self.status[i, j] = VALUE_MISSING
+                        continue
+                else:
+                    value = market[MARKET_CONDITIONS[name]]
+                self.values[i, j], self.status[i, j], self.is_int[i, j] = parse_condition_value(value)
+            if horse_indices:
+                values, status, is_int = horse_features.vector(runner.get('_horse_info'))
+                self.values[i, horse_indices] = values
+                self.status[i, horse_indices] = status
+                self.is_int[i, horse_indices] = is_int
+        # a feature missing for some runners made the whole column float in the DataFrame path
+        for j, name in stream_columns:
+            if name in FEATURE_CONDITIONS and (self.status[:, j] == VALUE_MISSING).any():
+                self.is_int[:, j] = False
+
+    def prices(self, field_name):
+        """Runner values of a price field as floats, None if the runners have no such field."""
+        prices = self._prices.get(field_name)
+        if prices is None:
+            runners = self.snapshot.runners.values()
+            if not any(field_name in runner for runner in runners):
+                return None
+            prices = self._prices[field_name] = np.array(
+                [np.nan if runner.get(field_name) is None else runner[field_name] for runner in runners],
+                dtype=float)
+        return prices
+
+
+class FeatureMatrix:
+    """
+    Condition values of all runners of all markets stacked into one matrix.
+
+    Rows are runners, grouped per market in snapshot order, columns are
+    condition names. Blocks are cached per snapshot, only markets that published
+    a new snapshot are rebuilt.
+
+    """
+
+    def __init__(self, blocks, columns):
+        self.blocks = blocks
+        self.columns = columns
+        self.offsets = {}
+        offset = 0
+        for market_id, block in blocks.items():
+            self.offsets[market_id] = offset
+            offset += len(block.keys)
+        self.rows = offset
+        if blocks:
+            self.values = np.concatenate([block.values for block in blocks.values()])
+            self.status = np.concatenate([block.status for block in blocks.values()])
+            self.is_int = np.concatenate([block.is_int for block in blocks.values()])
+        else:
+            self.values = np.empty((0, len(columns)))
+            self.status = np.empty((0, len(columns)), dtype=np.int8)
+            self.is_int = np.empty((0, len(columns)), dtype=bool)
+
+
+class MatrixBuilder:
+    """Builds the FeatureMatrix of a tick, reusing the blocks of unchanged snapshots."""
+
+    def __init__(self):
+        self._blocks = {}
+        self.horse_features = HorseFeatures(())
+
+    def build(self, market_snapshots, race_dict, strategies, market_ids=None):
+        """
+        Matrix of the markets in market_ids (all of market_snapshots if None).
+        Cached blocks of other markets are kept while they have a snapshot.
+        """
+        columns = condition_columns(strategies)
+        if columns != self.horse_features.columns:
+            self.horse_features = HorseFeatures(columns)
+        if market_ids is None:
+            market_ids = market_snapshots
+        cache = {market_id: block for market_id, block in self._blocks.items() if market_id in market_snapshots}
+        blocks = {}
+        for market_id in market_ids:
+            snapshot = market_snapshots.get(market_id)
+            if snapshot is None:
+                continue
+            runner_count = len(race_dict[market_id]['runners'])
+            block = cache.get(market_id)
+            if (block is None or block.snapshot is not snapshot or block.runner_count != runner_count
+                    or block.columns != columns):
+                block = cache[market_id] = MarketBlock(snapshot, runner_count, columns, self.horse_features)
+            blocks[market_id] = block
+        self._blocks = cache
+        return FeatureMatrix(blocks, columns)
+
+
+def condition_columns(strategies):
+    """Condition names used by any strategy, in first use order."""
+    columns = {}
+    for strategy in strategies:
+        for name, value in strategy.items():
+            if isinstance(value, dict):
+                columns[name] = None
+    return tuple(columns)
+
+
+class CompiledStrategy:
+    """
+    Min/max conditions of a strategy, evaluated for all rows of a FeatureMatrix at once.
+
+    Follows the row by row rules of StrategyHandler: a missing value either
+    fails the runner and ends its check or, with missingConditionsData 'risk',
+    is skipped. Values that are not numbers and values out of range fail the
+    runner, the last failing condition gives its status comment.
+
+    """
+
+    def __init__(self, strategy, columns):
+        self.strategy = strategy
+        self.columns = columns
+        column_index = {name: j for j, name in enumerate(columns)}
+        self.conditions = []  # (name, condition dict, matrix column, (min, max) or None if not numbers)
+        for name, value in strategy.items():
+            if not isinstance(value, dict):
+                continue
+            try:
+                bounds = float(value['min']), float(value['max'])
+            except Exception:
+                bounds = None
+            self.conditions.append((name, value, column_index[name], bounds))
+        self.missing_risk = strategy.get('missingConditionsData') == 'risk'
+
+    def evaluate(self, matrix):
+        """(index of the failing condition or -1, FAIL_* reason) per matrix row."""
+        failed = np.full(matrix.rows, -1, dtype=np.int32)
+        reason = np.zeros(matrix.rows, dtype=np.int8)
+        checking = np.ones(matrix.rows, dtype=bool)
+        for c, (_, _, j, bounds) in enumerate(self.conditions):
+            status = matrix.status[:, j]
+            missing = status == VALUE_MISSING
+            if not self.missing_risk:
+                hit = checking & missing
+                failed[hit] = c
+                reason[hit] = FAIL_MISSING
+                checking &= ~missing
+            present = checking & ~missing
+            if bounds is None:
+                not_a_number = present
+                out_of_range = None
+            else:
+                not_a_number = present & (status == VALUE_NOT_A_NUMBER)
+                values = matrix.values[:, j]
+                with np.errstate(invalid='ignore'):
+                    in_range = (bounds[0] <= values) & (values <= bounds[1])
+                out_of_range = present & (status == VALUE_OK) & ~in_range
+            failed[not_a_number] = c
+            reason[not_a_number] = FAIL_NOT_A_NUMBER
+            if out_of_range is not None:
+                failed[out_of_range] = c
+                reason[out_of_range] = FAIL_RANGE
+        return failed, reason
+
+    def comment(self, matrix, row, condition, reason):
+        """Status comment of a runner that failed condition for reason."""
+        name, value, j, _ = self.conditions[condition]
+        if reason == FAIL_MISSING:
+            return f'{name} not found in data'
+        if reason == FAIL_NOT_A_NUMBER:
+            return f'{name} not a number'
+        number = float(matrix.values[row, j])
+        if matrix.is_int[row, j]:
+            number = int(number)
+        return f'{name} condition not met {value["min"]} <= {round(number, 2)} <= {value["max"]}'
+
+
+class StrategyCompiler:
+    """CompiledStrategy per strategy, recompiled only when the strategy or the matrix columns change."""
+
+    def __init__(self):
+        self._compiled = {}  # strategies key -> CompiledStrategy
+        self.compilations = 0
+
+    def compile(self, strategies, columns):
+        compiled = {}
+        for key, strategy in strategies.items():
+            previous = self._compiled.get(key)
+            # strategies are reloaded as new dicts, unchanged ones compare equal
+            if previous is None or previous.columns != columns or (
+                    previous.strategy is not strategy and previous.strategy != strategy):
+                previous = CompiledStrategy(strategy, columns)
+                self.compilations += 1
+            compiled[key] = previous
+        self._compiled = compiled
+        return compiled
@@ -0,0 +1,112 @@
+"""Places order intents off the event loop, one placeOrders call per market."""
+import asyncio
+import logging
+import time
+
+from betfair.betting import limit_instruction, place_orders
+from betfair.transport import PRIORITY_ORDERS, betfair_rest
+
+log = logging.getLogger(__name__)
+
+MAX_INSTRUCTIONS_PER_CALL = 200  # placeOrders limit of the exchange
+
+
+class OrderIntent:
+    __slots__ = ('market_id', 'selection_id', 'size', 'price', 'side', 'persistence_type', 'future', 'queued')
+
+    def __init__(self, market_id, selection_id, size, price, side, persistence_type, future):
+        self.market_id = market_id
+        self.selection_id = selection_id
+        self.size = size
+        self.price = price
+        self.side = side
+        self.persistence_type = persistence_type
+        self.future = future
+        self.queued = time.perf_counter()
+
+
+class ExecutionService:
+    """
+    Order execution that never blocks the event loop.
+
+    submit() queues an order intent and returns a future of its
+    (status, bet id, average price matched). The worker takes every intent
+    queued so far, groups them per market and sends each group as one
+    placeOrders call through the REST transport, at order priority, so the
+    intents of one strategy pass go out together and markets don't wait for
+    each other.
+
+    Args:
+        place (callable): place_orders(market_id, instructions) -> (status, instruction reports)
+        transport (BetfairTransport): runs the calls off the event loop
+
+    """
+
+    def __init__(self, place=place_orders, transport=betfair_rest):
+        self.place = place
+        self.transport = transport
+        self._queue = None
+        self._worker = None
+        self._calls = set()  # running placeOrders calls, referenced until done
+        self.stats = {'intents': 0, 'calls': 0, 'failed_calls': 0, 'max_batch': 0, 'last_round_trip_ms': None,
+                      'max_round_trip_ms': 0.}
+
+    def submit(self, market_id, selection_id, size, price, side='LAY', persistence_type='LAPSE'):
+        loop = asyncio.get_running_loop()
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        self._queue.put_nowait(OrderIntent(market_id, selection_id, size, price, side, persistence_type, future))
+        self.stats['intents'] += 1
+        return future
+
+    async def _run(self):
+        while True:
+            intents = [await self._queue.get()]
+            while not self._queue.empty():
+                intents.append(self._queue.get_nowait())
+            batches = {}
+            for intent in intents:
+                batches.setdefault(intent.market_id, []).append(intent)
+            for market_id, market_intents in batches.items():
+                for start in range(0, len(market_intents), MAX_INSTRUCTIONS_PER_CALL):
+                    call = asyncio.ensure_future(
+                        self._place(market_id, market_intents[start:start + MAX_INSTRUCTIONS_PER_CALL]))
+                    self._calls.add(call)
+                    call.add_done_callback(self._calls.discard)
+
+    async def _place(self, market_id, intents):
+        stats = self.stats
+        stats['calls'] += 1
+        stats['max_batch'] = max(stats['max_batch'], len(intents))
+        started = time.perf_counter()
+        try:
+            # inside the try, an intent that cannot be turned into an instruction fails the whole batch
+            instructions = [limit_instruction(intent.selection_id, intent.size, intent.price, side=intent.side,
+                                              persistence_type=intent.persistence_type)
+                            for intent in intents]
+            status, reports = await self.transport.call(
+                'betting.place_orders', self.place, market_id, instructions, priority=PRIORITY_ORDERS)
+        except Exception as e:
+            stats['failed_calls'] += 1
+            log.error(f"placeOrders of {len(intents)} instructions on {market_id} failed: {e}")
+            for intent in intents:
+                if not intent.future.done():
+                    intent.future.set_exception(e)
+            return
+        round_trip_ms = (time.perf_counter() - started) * 1000
+        stats['last_round_trip_ms'] = round_trip_ms
+        stats['max_round_trip_ms'] = max(stats['max_round_trip_ms'], round_trip_ms)
+        log.debug(f"placeOrders of {len(intents)} instructions on {market_id}: {status} in {round_trip_ms:.0f} ms, "
+                  f"queued {(started - intents[0].queued) * 1000:.1f} ms")
+        # reports come in the order of the instructions, a failed call can leave them out
+        reports = list(reports or [])
+        for i, intent in enumerate(intents):
+            if intent.future.done():
+                continue
+            if i < len(reports):
+                report = reports[i]
+                intent.future.set_result((report.status, report.bet_id, report.average_price_matched))
+            else:
+                intent.future.set_result((status, None, None))
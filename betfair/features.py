@@ -0,0 +1,48 @@
+"""Order book features per runner, computed from the tick indexed RunnerBook."""
+from betfair.orderbook import TICK_PRICES
+
+FEATURE_LEVELS = 3  # same depth as ladder_levels of the stream subscription
+
+# RunnerState field -> condition name used by strategies
+BOOK_FEATURE_CONDITIONS = {
+    'wom': 'Weight of money',
+    'microprice': 'Microprice',
+    'spread_ticks': 'Spread ticks',
+    'depth_imbalance': 'Depth imbalance',
+    'back_vwap': 'Back VWAP',
+    'lay_vwap': 'Lay VWAP',
+}
+
+
+def update_book_features(book, runner, levels=FEATURE_LEVELS):
+    """
+    Write book features of a runner into its RunnerState.
+
+    Sums the best levels of each side with RunnerBook.depth, straight on the book
+    arrays. Features that need a side that is empty are set to None.
+
+    wom: share of available to back money at the best prices, back / (back + lay)
+    microprice: best back and lay price weighted by the size on the opposite side
+    spread_ticks: ticks between best back and best lay
+    depth_imbalance: (back - lay) / (back + lay) over the best `levels` levels
+    back_vwap, lay_vwap: volume weighted price of the best `levels` levels
+
+    """
+    back_depth, back_value = book.depth('back', levels)
+    lay_depth, lay_value = book.depth('lay', levels)
+    runner.back_vwap = back_value / back_depth if back_depth else None
+    runner.lay_vwap = lay_value / lay_depth if lay_depth else None
+
+    if back_depth and lay_depth:
+        back_size = book.back_sizes[book.best_back]
+        lay_size = book.lay_sizes[book.best_lay]
+        runner.wom = back_size / (back_size + lay_size)
+        runner.microprice = ((TICK_PRICES[book.best_back] * lay_size + TICK_PRICES[book.best_lay] * back_size)
+                             / (back_size + lay_size))
+        runner.spread_ticks = book.best_lay - book.best_back
+        runner.depth_imbalance = (back_depth - lay_depth) / (back_depth + lay_depth)
+    else:
+        runner.wom = None
+        runner.microprice = None
+        runner.spread_ticks = None
+        runner.depth_imbalance = None
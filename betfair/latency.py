@@ -0,0 +1,107 @@
+"""Fixed bucket latency histograms for the stream feed."""
+import time
+from bisect import bisect_left
+
+# bucket upper bounds in milliseconds, values above the last bound go to an overflow bucket
+LATENCY_BUCKETS_MS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+LATENCY_LOG_SECONDS = 60
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies per fixed bucket with p50/p99 estimates and the exact max.
+
+    Percentiles are reported as the upper bound of the bucket they fall in,
+    capped at the max seen. Negative values (clock skew between the exchange
+    and this host) are counted in the first bucket.
+
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, ms):
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if i == len(LATENCY_BUCKETS_MS):
+                    return self.max
+                return min(LATENCY_BUCKETS_MS[i], self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(.5),
+                'p99': self.percentile(.99),
+                'max': self.max if self.count else None}
+
+
+class FeedLatency:
+    """
+    Latency histograms of one stream connection.
+
+    network: publish time (pt) to receipt by the listener, exchange clock against local clock
+    decode: json decoding of the message
+    apply: everything after decoding, state updates and snapshot publication
+
+    Per market, network and apply (the market's own runner and market updates)
+    are kept as well. Histograms cover the time since the last reset.
+
+    """
+
+    def __init__(self):
+        self.network = LatencyHistogram()
+        self.decode = LatencyHistogram()
+        self.apply = LatencyHistogram()
+        self.markets = {}  # market id -> (network, apply)
+        self.since = time.time()
+
+    def market(self, market_id):
+        histograms = self.markets.get(market_id)
+        if histograms is None:
+            histograms = self.markets[market_id] = (LatencyHistogram(), LatencyHistogram())
+        return histograms
+
+    def reset(self):
+        self.network = LatencyHistogram()
+        self.decode = LatencyHistogram()
+        self.apply = LatencyHistogram()
+        self.markets = {}
+        self.since = time.time()
+
+    def summary(self, markets=True):
+        result = {'seconds': time.time() - self.since,
+                  'network': self.network.summary(),
+                  'decode': self.decode.summary(),
+                  'apply': self.apply.summary()}
+        if markets:
+            result['markets'] = {market_id: {'network': network.summary(), 'apply': apply.summary()}
+                                 for market_id, (network, apply) in list(self.markets.items())}
+        return result
+
+
+def format_summary(summary):
+    """One log line of p50/p99/max per histogram."""
+    def fmt(values):
+        if not values['count']:
+            return '-'
+        return f"p50 {values['p50']:.2f} p99 {values['p99']:.2f} max {values['max']:.2f}"
+    return (f"network {fmt(summary['network'])} | decode {fmt(summary['decode'])} | "
+            f"apply {fmt(summary['apply'])} ms over {summary['network']['count']} messages")
@@ -1,11 +1,8 @@
 import asyncio
-import collections
-import copy
 import json
 import logging
 import queue
 import time
-from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Dict
 
@@ -14,31 +11,36 @@ import pandas as pd
 import pytz
 import uvicorn
 import websockets
-from betfairlightweight.exceptions import SocketError
-from betfairlightweight.filters import (streaming_market_data_filter,
-                                        streaming_market_filter)
 from fastapi import (FastAPI, HTTPException, Request, WebSocket,
                      WebSocketDisconnect)
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from requests import request
-from tenacity import retry, wait_exponential
 
 from betfair.config import (COUNTRIES, EVENT_TYPE_IDS, MARKET_TYPES,
-                            STREAM_RESTART_MINUTES, admin_collection, client,
-                            orders_collection, strategy_collection, winner_collection)
+                            admin_collection, client,
+                            orders_collection, strategy_collection, tickdata_collection, winner_collection)
 
 from betfair.mongo_manager import (get_orders_without_estimated_winner, get_strategies_for_play, insert_winner,
                                    update_estimated_profit, get_data_for_hypothetical_payoff)
 
+from betfair.clock import MarketClock
 from betfair.helper import init_logger
+from betfair.latency import LATENCY_LOG_SECONDS
 from betfair.metadata import get_current_event_metadata
+from betfair.order_index import ORDER_LOAD_RETRY_SECONDS, ORDER_LOAD_TIMEOUT_SECONDS
+from betfair.session import session_manager
+from betfair.snapshot import SnapshotStore
+from betfair.state import market_payload, memory_report
 from betfair.strategy import StrategyHandler
-from betfair.streamer import HorseRaceListener
+from betfair.stream_pool import STREAM_POOL_UPDATE_SECONDS, StreamPool
+from betfair.subscriptions import SubscriptionScheduler
+from betfair.streamer import SAVE_TICKDATA_TO_MONGO, HorseRaceListener
+from betfair.tickwriter import TickDataWriter
+from betfair.transport import PRIORITY_ANALYTICS, betfair_rest
+from betfair.trigger import MarketTrigger
 from betfair.api import app
 
-lock = asyncio.Lock()
-
 init_logger(screenlevel=logging.INFO, filename='default')
 
 race_data_available = asyncio.Event()
@@ -52,7 +54,7 @@ async def orders():
     bot_orders_json = list(orders_collection.find({}, {'_id': False}))
 
     # Use the list_current_orders method to retrieve information about your orders
-    response = client.betting.list_cleared_orders()
+    response = await betfair_rest.request('betting.list_cleared_orders', priority=PRIORITY_ANALYTICS)
     orders = response.orders
     # Convert orders to a format suitable for JSON serialization
     elements = [x for x in dir(orders[0]) if x[0] != '_' and x != 'get']
@@ -90,12 +92,37 @@ async def orders():
 
 @app.post("/balance")
 async def balance():
-    resp = client.account.get_account_funds()
+    resp = await betfair_rest.request('account.get_account_funds', priority=PRIORITY_ANALYTICS)
     return {'Available Funds': resp.available_to_bet_balance,
             'Current exposure': -resp.exposure,
             'Total Funds':  resp.available_to_bet_balance-resp.exposure}
 
 
+@app.post("/memory")
+async def memory():
+    return memory_report(ff_cache)
+
+
+@app.post("/streams")
+async def streams():
+    return {'connections': stream_pool.stats(), 'subscriptions': subscription_scheduler.stats}
+
+
+@app.post("/latency")
+async def latency():
+    """Feed latency histograms since the last periodic latency log, per connection and market, strategy wake ups,
+    order placement round trips and REST call times."""
+    return {'feed': stream_pool.latency(), 'strategy_triggers': market_trigger.stats,
+            'execution': strategy_handler.execution.stats, 'rest': betfair_rest.stats,
+            'rest_budget': betfair_rest.budget.stats}
+
+
+@app.post("/session")
+async def session():
+    """Logins, keep alives and time spent authenticating."""
+    return session_manager.stats
+
+
 @app.post("/load_admin")
 async def load_admin():
     return list(admin_collection.find({"Email": "default"}, {'_id': False}))[0]
@@ -187,120 +214,61 @@ async def last_prices(websocket: WebSocket):
     while True:
         await race_data_available.wait()
 
-        def convert_deque(data):
-            """
-            Converts deque objects to lists and recursively converts nested deques and dicts.
-
-            :param data: Deque or dict object
-            :return: Converted list or dict object
-            """
-            if isinstance(data, collections.deque):
-                return list(data)
-            elif isinstance(data, dict):
-                return {k: convert_deque(v) for k, v in data.items()}
-            else:
-                return data
-
         # Before sending the data
-        converted_ff_cache = convert_deque(ff_cache)
+        current_snapshots = market_snapshots.snapshots
+        payload = {market_id: market_payload(snapshot, ff_cache.get(market_id))
+                   for market_id, snapshot in current_snapshots.items()}
 
         try:
-            await websocket.send_json({"ff_cache": dict(converted_ff_cache)})
+            await websocket.send_json({"ff_cache": payload})
         except websockets.exceptions.ConnectionClosedOK:
             break
         except TypeError as e:
             log.error(f"TypeError: {e}")
-            log.error(f"Offending data: {converted_ff_cache}")
+            log.error(f"Offending data: {payload}")
             # Optionally, re-raise the exception if you want the error to propagate
             # raise
         await asyncio.sleep(1)
 
 
-class StreamWithReconnect:
-    def __init__(self, client, listener, market_filter, market_data_filter):
-        self.client = client
-        self.listener = listener
-        self.market_filter = market_filter
-        self.market_data_filter = market_data_filter
-
-    def update_market_filter(self, new_market_filter):
-        self.market_filter = new_market_filter
-
-    def update_market_data_filter(self, new_market_data_filter):
-        self.market_data_filter = new_market_data_filter
-
-    @retry(wait=wait_exponential(multiplier=1, min=2, max=30))
-    async def run(self):
-        log.info("Starting StreamWithReconnect")
-        loop = asyncio.get_event_loop()
-
-        try:
-            # If the create_stream method is synchronous
-            self.stream = await loop.run_in_executor(None, lambda: self.client.streaming.create_stream(listener=self.listener))
-
-            # If the subscribe_to_markets method is synchronous
-            await loop.run_in_executor(None, lambda: self.stream.subscribe_to_markets(market_filter=self.market_filter, market_data_filter=self.market_data_filter))
-
-            # If the start method is synchronous
-            await loop.run_in_executor(None, self.stream.start)
-
-        except Exception as e:  # Adjust the exception types as needed
-            log.critical(f"Unhandled exception: {e}")
-            raise
-
-    def stop(self):
-        if self.stream is not None:
-            # Add logic here to stop the stream. This depends on how your streaming client is implemented.
-            self.stream.stop()
-
-
-async def connect_to_stream(stream_with_reconnect):
-    # log.info(f"Current race_ids: {race_ids}")  # Add debug log
-    market_filter = streaming_market_filter(
-        market_ids=list(race_ids)
-    )
-    market_data_filter = streaming_market_data_filter(
-        fields=['EX_MARKET_DEF', 'EX_ALL_OFFERS', 'EX_TRADED'],
-        ladder_levels=3
-    )
-
-    stream_with_reconnect.update_market_filter(market_filter)
-    stream_with_reconnect.update_market_data_filter(market_data_filter)
-    await stream_with_reconnect.run()
+async def run_stream_pool(interval=STREAM_POOL_UPDATE_SECONDS):
+    """Keep the stream pool subscribed to the markets the active strategies can bet on."""
+    loop = asyncio.get_event_loop()
+    while True:
+        market_ids, next_change = subscription_scheduler.plan(race_ids, race_dict, strategies)
+        # changed subscriptions are sent on the sockets, which blocks
+        await loop.run_in_executor(None, stream_pool.update, market_ids)
+        stream_pool.log_stats()
+        log.info(f"Subscriptions: {subscription_scheduler.stats}")
+        # wake up for the next window that opens or closes, new metadata and strategies within interval
+        delay = interval if next_change is None else min(interval, max(next_change - time.time(), 1))
+        await asyncio.sleep(delay)
 
 
-async def schedule_stream_restart(interval_minutes=STREAM_RESTART_MINUTES):
-    listener = HorseRaceListener(
-        ff_cache, race_ids, last_cache, race_dict,
-        punters_com_au, horse_info_dict, runnerid_name_dict
-    )
-    stream_with_reconnect = StreamWithReconnect(client, listener, None, None)
-
+async def log_stream_latency(interval=LATENCY_LOG_SECONDS):
     while True:
-        log.info("Starting new streaming session")
-        stream_task = asyncio.create_task(
-            connect_to_stream(stream_with_reconnect))
-        # Convert minutes to seconds
-        await asyncio.sleep(interval_minutes * 60)
-        log.info("Stopping current streaming session")
+        await asyncio.sleep(interval)
+        stream_pool.log_latency()
 
-        # Stop the old stream
-        stream_with_reconnect.stop()
 
-        stream_task.cancel()
+async def check_strategy(ff_cache, race_dict, runnerid_name_dict, strategies):
+    """Check the strategies on markets with new prices or a strategy window opening or closing."""
+    # orders placed before a restart count against the strategies' limits, no bets until they are loaded
+    while True:
         try:
-            await stream_task
-        except asyncio.CancelledError:
-            pass
-
-
-async def check_strategy(last_cache, ff_cache, race_dict, runnerid_name_dict, strategies):
+            await asyncio.wait_for(strategy_handler.load_orders(), ORDER_LOAD_TIMEOUT_SECONDS)
+            break
+        except Exception as e:
+            log.critical(f"Loading orders failed, trying again in {ORDER_LOAD_RETRY_SECONDS} s: {e!r}")
+            await asyncio.sleep(ORDER_LOAD_RETRY_SECONDS)
     while True:
+        # windows of newly streamed markets, the clock times their enter and leave events
+        market_clock.update(race_dict, strategies, market_snapshots.snapshots)
+        market_ids = await market_trigger.wait()  # None: all markets
         await strategy_handler.check_execute(
-            last_cache, ff_cache, race_dict, runnerid_name_dict, strategies)
+            ff_cache, race_dict, runnerid_name_dict, strategies, market_snapshots, market_ids)
         await strategy_handler.check_modify(
-            last_cache, ff_cache, race_dict, runnerid_name_dict, strategies)
-        await asyncio.sleep(.01)
+            ff_cache, race_dict, runnerid_name_dict, strategies)
 
 
 async def load_strategies(strategies):
@@ -309,6 +277,7 @@ async def load_strategies(strategies):
         loaded_strategies = await get_strategies_for_play()
         log.debug('Done')
 
+        previous_strategies = dict(strategies)
         # Populate the strategies dictionary with loaded strategies
         loaded_strategy_names = set()
         for strategy in loaded_strategies:
@@ -321,17 +290,21 @@ async def load_strategies(strategies):
             name for name in strategies.keys() if name not in loaded_strategy_names]
         for name_to_remove in strategy_names_to_remove:
             del strategies[name_to_remove]
+        if strategies != previous_strategies:
+            market_trigger.mark_all()
 
         for race_id in list(ff_cache.keys()):
             if race_id not in race_ids:
-                winner = get_winner(race_id)
+                winner = await get_winner(race_id)
                 if not winner:
                     log.debug("No winner found")
                     continue
                 winner_collection.insert_one(
                     {'market_id': race_id, 'winner': winner, 'timestamp': datetime.utcnow()})
-                
-                del ff_cache[race_id]
+
+                market_snapshots.remove(race_id)
+                ff_cache.pop(race_id, None)
+                strategy_handler.order_index.forget(race_id)
 
         await asyncio.sleep(15)
 
@@ -343,7 +316,7 @@ async def hypothetical_payoff_calc():
         # add winners to winner collection
         race_ids = await get_orders_without_estimated_winner(hours=12)
         for race_id in race_ids:
-            winner = get_winner(race_id)
+            winner = await get_winner(race_id)
             if not winner:
                 log.warning("No winner found")
                 continue
@@ -391,9 +364,11 @@ async def hypothetical_payoff_calc():
         await asyncio.sleep(234)
 
 
-def get_winner(market_id):
+async def get_winner(market_id):
     """use betfairleightweight to get the winner of a market"""
-    market_book = client.betting.list_market_book(
+    # load_strategies and hypothetical_payoff_calc ask for the same markets, concurrent requests share one call
+    market_book = await betfair_rest.request(
+        'betting.list_market_book', priority=PRIORITY_ANALYTICS,
         market_ids=[market_id], price_projection={"priceData": ["EX_BEST_OFFERS"]}
     )
     if not market_book:
@@ -407,40 +382,36 @@ def get_winner(market_id):
         return winners
 
 
-async def update_remaining_time(ff_cache):
-    while True:
-        async with lock:
-            ff_copy = copy.copy(ff_cache)
-        for market_id, race_data in ff_copy.items():
-            ff = ff_cache
-            try:
-                iso_format_string = ff[market_id]['_race_start_time']
-                race_start_time = datetime.fromisoformat(iso_format_string)
-                race_data['_seconds_to_start'] = (
-                    race_start_time - datetime.utcnow().replace(tzinfo=pytz.utc)).total_seconds()
-                ff[market_id]['_seconds_to_start'] = race_data['_seconds_to_start']
-            except TypeError:
-                log.error(
-                    "TypeError in update_remaining_time, no starttime")
-        await asyncio.sleep(.5)
-
-
 @app.on_event("startup")
 async def startup_event():
     loop = asyncio.get_event_loop()
     try:
+        loop.create_task(session_manager.run())
         loop.create_task(get_current_event_metadata(
             race_ids, race_dict, race_data_available, horse_info_dict, runnerid_name_dict))
         loop.create_task(load_strategies(strategies))
-        loop.create_task(check_strategy(last_cache, ff_cache,
+        loop.create_task(check_strategy(ff_cache,
                          race_dict, runnerid_name_dict, strategies))
-        loop.create_task(update_remaining_time(ff_cache))
-        loop.create_task(schedule_stream_restart())
+        loop.create_task(run_stream_pool())
+        loop.create_task(log_stream_latency())
         loop.create_task(hypothetical_payoff_calc())
     except Exception as e:
         log.critical(f"Error during startup: {e}")
 
 
+def stop_streaming():
+    """Stop the stream connections, then write the tick rows they queued."""
+    # closes the sockets and the stream recordings, joining the reader threads
+    stream_pool.stop()
+    if tick_writer is not None:
+        tick_writer.stop()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await asyncio.get_event_loop().run_in_executor(None, stop_streaming)
+
+
 if __name__ == '__main__':
     strategy_handler = StrategyHandler()
     race_ids = set()
@@ -450,7 +421,18 @@ if __name__ == '__main__':
     runnerid_name_dict = dict()
     orders = dict()
     strategies = dict()
-    ff_cache = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
-    last_cache = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
+    ff_cache = dict()  # market id -> MarketState
+    market_snapshots = SnapshotStore()
+    market_clock = MarketClock()
+    market_trigger = MarketTrigger(market_clock)
+    # one writer thread and queue for the ticks of all connections
+    tick_writer = None
+    if SAVE_TICKDATA_TO_MONGO:
+        tick_writer = TickDataWriter(tickdata_collection)
+        tick_writer.start()
+    stream_pool = StreamPool(client, lambda: HorseRaceListener(
+        ff_cache, frozenset(), race_dict, punters_com_au, horse_info_dict, runnerid_name_dict, market_snapshots,
+        market_trigger, tick_writer), session_manager=session_manager)
+    subscription_scheduler = SubscriptionScheduler(stream_pool.capacity, market_clock)
 
     uvicorn.run(app, host="0.0.0.0", port=7779)
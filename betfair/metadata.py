@@ -10,8 +10,10 @@ import pytz
 from betfair.config import (COUNTRIES, EVENT_TYPE_IDS, HOURS_TO_FETCH,
                             KEEP_AFTER_RACE_START_MIN, MARKET_TYPES,
                             MAX_RACE_STREAMS, SECS_MARKET_FETCH_INTERVAL,
-                            client, punters_com_au_collection,
+                            punters_com_au_collection,
                             upsert_event_metadata)
+from betfair.session import session_manager
+from betfair.transport import betfair_rest
 
 log = logging.getLogger(__name__)
 
@@ -20,10 +22,11 @@ async def get_current_event_metadata(race_ids, race_dict, race_data_available, h
     while True:  # Repeat indefinitely
         # Get the current time and the time 60 minutes from now
         try:
-            client.login_interactive()
-        except:
+            await session_manager.ensure()  # logs in only before the first cycle or after the session was lost
+        except Exception:
             log.critical("Interactive login failed. Trying again in 1min.")
             await asyncio.sleep(60)
+            continue
         now = datetime.utcnow()
         end_time = now + timedelta(hours=HOURS_TO_FETCH)
         race_datas = []
@@ -45,7 +48,8 @@ async def get_current_event_metadata(race_ids, race_dict, race_data_available, h
             }
 
             # Retrieve the list of races
-            races = client.betting.list_market_catalogue(
+            races = await betfair_rest.request(
+                'betting.list_market_catalogue',
                 filter=market_filter,
                 max_results=MAX_RACE_STREAMS,
                 sort="FIRST_TO_START",
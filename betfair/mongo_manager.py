@@ -107,6 +107,20 @@ async def get_orders_without_estimated_winner(hours):
     return market_ids
 
 
+async def get_recent_orders(hours, host):
+    # market, user, strategy and selection of the orders host placed in the last hours based on _id
+    delta = datetime.utcnow() - timedelta(hours=hours)
+    hexSeconds = format(int(delta.timestamp()), 'x')
+    constructedObjectId = ObjectId(hexSeconds + "0000000000000000")
+
+    cursor = orders_collection.find(
+        # orders written before they carried their host count too, rather blocking a bet than placing it twice
+        {'_id': {'$gte': constructedObjectId}, 'host': {'$in': [host, None]}},
+        {'_id': False, 'market_id': True, 'user': True, 'strategy_name': True, 'selection_id': True}
+    )
+    return await cursor.to_list(length=None)
+
+
 async def insert_winner(data, filter_dict):
     # TODO: ensure winner collection has market_id as index
     update_result = await winner_collection.update_one(
@@ -0,0 +1,57 @@
+"""Orders placed per market, counted per strategy and per selection."""
+import logging
+
+log = logging.getLogger(__name__)
+
+ORDER_INDEX_HOURS = 24  # orders loaded at startup, covers every market that can still be bet on
+ORDER_LOAD_TIMEOUT_SECONDS = 30
+ORDER_LOAD_RETRY_SECONDS = 10
+
+
+class OrderIndex:
+    """
+    Constant time lookups of the orders placed by the strategies.
+
+    Keeps the number of orders per (market, user, strategy name) and the
+    selections with an order per market. Rebuilt at startup from the orders
+    this computer placed, so a restart neither bets again on a runner nor
+    beyond a strategy's maximum number of horses on a market.
+
+    """
+
+    def __init__(self):
+        self._counts = {}  # (market id, user, strategy name) -> orders
+        self._selections = {}  # market id -> selection ids with an order
+        self.orders = 0
+
+    def record(self, order):
+        market_id = order['market_id']
+        key = (market_id, order.get('user', 'default'), order.get('strategy_name'))
+        self._counts[key] = self._counts.get(key, 0) + 1
+        selections = self._selections.get(market_id)
+        if selections is None:
+            selections = self._selections[market_id] = set()
+        selections.add(str(order['selection_id']))
+        self.orders += 1
+
+    def load(self, orders):
+        for order in orders:
+            if 'market_id' not in order or 'selection_id' not in order:
+                continue
+            self.record(order)
+        log.info(f"Order index loaded {self.orders} orders on {len(self._selections)} markets")
+
+    def count(self, market_id, user, strategy_name):
+        return self._counts.get((market_id, user, strategy_name), 0)
+
+    def has_order(self, market_id, selection_id):
+        selections = self._selections.get(market_id)
+        return selections is not None and str(selection_id) in selections
+
+    def forget(self, market_id):
+        """Drop the orders of a market that can no longer be bet on."""
+        selections = self._selections.pop(market_id, None)
+        if selections is None:
+            return
+        for key in [key for key in self._counts if key[0] == market_id]:
+            self.orders -= self._counts.pop(key)
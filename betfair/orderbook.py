@@ -0,0 +1,155 @@
+"""Price ladder order book per runner, built from streamed atb/atl deltas."""
+import bisect
+from array import array
+
+BOOK_VWAP_LEVELS = 3
+# (first price, last price, increment) of the price bands of the exchange
+tick_sizes = [(1.01, 2, 0.01),
+              (2.02, 3, 0.02),
+              (3.05, 4, 0.05),
+              (4.1, 6, 0.1),
+              (6.2, 10, 0.2),
+              (10.5, 20, 0.5),
+              (21, 30, 1.),
+              (32, 50, 2.),
+              (55, 100, 5.),
+              (110, 1000, 10.)]
+
+
+def create_tick_prices():
+    """All ladder prices from tick_sizes, with the upper bound of each band included (1.01 ... 1000)."""
+    prices = []
+    for start, end, step in tick_sizes:
+        ticks = int(round((end - start) / step))
+        prices.extend(round(start + i * step, 2) for i in range(ticks + 1))
+    return prices
+
+
+TICK_PRICES = create_tick_prices()
+NUM_TICKS = len(TICK_PRICES)
+TICK_INDEX = {price: i for i, price in enumerate(TICK_PRICES)}
+
+
+def price_to_tick(price):
+    """Ladder index of a price, prices between ticks are mapped to the nearest tick."""
+    try:
+        return TICK_INDEX[price]
+    except KeyError:
+        i = bisect.bisect_left(TICK_PRICES, price)
+        if i == 0:
+            return 0
+        if i == NUM_TICKS:
+            return NUM_TICKS - 1
+        return i if TICK_PRICES[i] - price < price - TICK_PRICES[i - 1] else i - 1
+
+
+class RunnerBook:
+    """
+    Available to back and available to lay sizes of one runner, indexed by tick.
+
+    Stream deltas are [price, size] pairs where size 0 removes the level. The best
+    back (highest atb price) and best lay (lowest atl price) tick indices are
+    maintained on every delta, so reading the top of the book is O(1).
+
+    """
+
+    __slots__ = ('back_sizes', 'lay_sizes', 'best_back', 'best_lay')
+
+    def __init__(self):
+        self.back_sizes = array('d', bytes(8 * NUM_TICKS))
+        self.lay_sizes = array('d', bytes(8 * NUM_TICKS))
+        self.best_back = -1  # no back price
+        self.best_lay = NUM_TICKS  # no lay price
+
+    def clear(self):
+        self.back_sizes = array('d', bytes(8 * NUM_TICKS))
+        self.lay_sizes = array('d', bytes(8 * NUM_TICKS))
+        self.best_back = -1
+        self.best_lay = NUM_TICKS
+
+    def update_back(self, levels):
+        """Apply atb deltas."""
+        sizes = self.back_sizes
+        for price, size in levels:
+            i = price_to_tick(price)
+            sizes[i] = size
+            if size > 0:
+                if i > self.best_back:
+                    self.best_back = i
+            elif i == self.best_back:
+                best = i - 1
+                while best >= 0 and not sizes[best]:
+                    best -= 1
+                self.best_back = best
+
+    def update_lay(self, levels):
+        """Apply atl deltas."""
+        sizes = self.lay_sizes
+        for price, size in levels:
+            i = price_to_tick(price)
+            sizes[i] = size
+            if size > 0:
+                if i < self.best_lay:
+                    self.best_lay = i
+            elif i == self.best_lay:
+                best = i + 1
+                while best < NUM_TICKS and not sizes[best]:
+                    best += 1
+                self.best_lay = best
+
+    @property
+    def back_price(self):
+        return TICK_PRICES[self.best_back] if self.best_back >= 0 else 0.0
+
+    @property
+    def lay_price(self):
+        return TICK_PRICES[self.best_lay] if self.best_lay < NUM_TICKS else 0.0
+
+    @property
+    def back_size(self):
+        return self.back_sizes[self.best_back] if self.best_back >= 0 else 0.0
+
+    @property
+    def lay_size(self):
+        return self.lay_sizes[self.best_lay] if self.best_lay < NUM_TICKS else 0.0
+
+    def best_levels(self, side, n=3):
+        """Best n (price, size) levels of 'back' or 'lay', best price first."""
+        levels = []
+        if side == 'back':
+            sizes, i, step, stop = self.back_sizes, self.best_back, -1, -1
+        else:
+            sizes, i, step, stop = self.lay_sizes, self.best_lay, 1, NUM_TICKS
+        while i != stop and len(levels) < n:
+            if sizes[i]:
+                levels.append((TICK_PRICES[i], sizes[i]))
+            i += step
+        return levels
+
+    def size_at(self, side, price):
+        """Depth available at a price."""
+        sizes = self.back_sizes if side == 'back' else self.lay_sizes
+        return sizes[price_to_tick(price)]
+
+    def depth(self, side, levels=BOOK_VWAP_LEVELS):
+        """(size, size * price) summed over the best levels of a side."""
+        total_size = 0.
+        total_value = 0.
+        if side == 'back':
+            sizes, i, step, stop = self.back_sizes, self.best_back, -1, -1
+        else:
+            sizes, i, step, stop = self.lay_sizes, self.best_lay, 1, NUM_TICKS
+        found = 0
+        while i != stop and found < levels:
+            size = sizes[i]
+            if size:
+                total_size += size
+                total_value += size * TICK_PRICES[i]
+                found += 1
+            i += step
+        return total_size, total_value
+
+    def vwap(self, side, levels=BOOK_VWAP_LEVELS):
+        """Volume weighted average price over the best levels of a side, None if the side is empty."""
+        total_size, total_value = self.depth(side, levels)
+        return total_value / total_size if total_size else None
@@ -0,0 +1,56 @@
+"""Incremental market overround (sum of implied probabilities)."""
+import math
+
+PRICE_FIELDS = ('back', 'lay', 'last')
+RESYNC_INTERVAL = 1000
+
+
+class MarketOverround:
+    """
+    Running sum of 1/price over all runners of a market for back, lay and last.
+
+    Each runner's current contribution is stored, so a price change only adjusts
+    the total by the difference instead of walking the whole field. Runners
+    without a price (0 or None) contribute nothing, as before.
+
+    """
+
+    __slots__ = ('_sums', '_inverse', '_updates')
+
+    def __init__(self):
+        self._sums = dict.fromkeys(PRICE_FIELDS, 0.0)
+        self._inverse = {field_name: {} for field_name in PRICE_FIELDS}
+        self._updates = 0
+
+    def update(self, field_name, runner_id, price):
+        """Set the price of a runner and adjust the running sum by the delta."""
+        inverse = 1 / price if price else 0.0
+        contributions = self._inverse[field_name]
+        previous = contributions.get(runner_id, 0.0)
+        if inverse == previous:
+            return
+        contributions[runner_id] = inverse
+        self._sums[field_name] += inverse - previous
+
+        self._updates += 1
+        if self._updates >= RESYNC_INTERVAL:
+            self.resync()
+
+    def remove_runner(self, runner_id):
+        """Drop the contributions of a runner, True if it had any."""
+        removed = False
+        for field_name, contributions in self._inverse.items():
+            inverse = contributions.pop(runner_id, None)
+            if inverse is not None:
+                self._sums[field_name] -= inverse
+                removed = True
+        return removed
+
+    def resync(self):
+        """Recompute the sums exactly to discard accumulated float error."""
+        for field_name, contributions in self._inverse.items():
+            self._sums[field_name] = math.fsum(contributions.values())
+        self._updates = 0
+
+    def total(self, field_name):
+        return self._sums[field_name]
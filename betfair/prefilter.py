@@ -0,0 +1,108 @@
+"""Static market filters of the strategies, evaluated once per market and strategy version."""
+
+
+def is_harness_market(full_title):
+    name = full_title.lower()
+    return ('trot' in name) or ('pace' in name)
+
+
+def static_filter(strategy, race):
+    """
+    None if a strategy can bet on a race by its sport, market type, harness
+    selection and countries, else the strategy status comment why not.
+    """
+    strategy_event_type = strategy.get('selectedSportType', 'Horse Racing').lower()
+    if race['event_type']['name'].lower() != strategy_event_type:
+        return f'Strategy only for {strategy_event_type}.'
+    strategy_market_type = strategy.get('market_type', 'WIN')
+    if race['market_type'] != strategy_market_type:
+        return f'Strategy only for {strategy_market_type}.'
+    harness_selection = strategy.get('harnessSelection', 'any')
+    full_title = race['fullTitle']
+    is_harness = is_harness_market(full_title)
+    if harness_selection == 'Harness only' and not is_harness:
+        return f'Market {full_title} is not harness'
+    if harness_selection == 'Non harness only' and is_harness:
+        return f'Market {full_title} is harness'
+    country = race['event']['countryCode']
+    strategy_countries = strategy.get('selectedCountries', [])
+    if country not in strategy_countries:
+        return f'Country {country} not part of strategy countries {strategy_countries}'
+    return None
+
+
+def _static_key(strategies):
+    return tuple((name, strategy.get('selectedSportType'), strategy.get('market_type'),
+                  strategy.get('harnessSelection'), tuple(strategy.get('selectedCountries', ())))
+                 for name, strategy in strategies.items())
+
+
+class MarketFilters:
+    """Strategies that can bet on one market, and status comments of those that can't."""
+
+    __slots__ = ('race', 'matches', 'rejections')
+
+    def __init__(self, race, strategies):
+        self.race = race
+        self.matches = []  # strategies keys, in strategies order
+        self.rejections = {}  # StrategyName -> status comment
+        for name, strategy in strategies.items():
+            comment = static_filter(strategy, race)
+            if comment is None:
+                self.matches.append(name)
+            else:
+                self.rejections[strategy.get('StrategyName', 'Unknown')] = comment
+
+
+class StrategyIndex:
+    """
+    Market id to the strategies it can match on its static attributes.
+
+    A market's entry is recomputed when its metadata entry is replaced (the
+    metadata refresh writes new race dicts), all entries when a static field of
+    any strategy changed. Status comments of the rejected strategies are
+    written to a market state once per entry instead of on every check.
+
+    """
+
+    def __init__(self):
+        self._key = None
+        self._markets = {}  # market id -> MarketFilters
+        self._applied = {}  # market id -> (MarketFilters, MarketState) whose rejections were written
+        self.rebuilds = 0
+
+    def update(self, race_dict, strategies, market_ids):
+        """Bring the entries of market_ids up to date, returns market id -> MarketFilters."""
+        key = _static_key(strategies)
+        if key != self._key:
+            self._key = key
+            self._markets = {}
+            self.rebuilds += 1
+        markets = self._markets
+        for market_id in market_ids:
+            race = race_dict.get(market_id)
+            filters = markets.get(market_id)
+            if race is None:
+                if filters is not None:
+                    del markets[market_id]
+                continue
+            if filters is None or filters.race is not race:
+                markets[market_id] = MarketFilters(race, strategies)
+        return markets
+
+    def prune(self, market_ids):
+        """Drop the entries of markets not in market_ids, with the market states they reference."""
+        for market_id in [market_id for market_id in self._markets if market_id not in market_ids]:
+            del self._markets[market_id]
+        for market_id in [market_id for market_id in self._applied if market_id not in market_ids]:
+            del self._applied[market_id]
+
+    def apply_rejections(self, market_id, market_state):
+        filters = self._markets.get(market_id)
+        if filters is None:
+            return
+        applied = self._applied.get(market_id)
+        if applied is not None and applied[0] is filters and applied[1] is market_state:
+            return
+        market_state.strategy_status.update(filters.rejections)
+        self._applied[market_id] = (filters, market_state)
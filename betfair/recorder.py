@@ -0,0 +1,98 @@
+"""Recording of raw stream payloads to compressed, rotating local files."""
+import glob
+import gzip
+import logging
+import os
+import time
+import zlib
+from datetime import datetime
+
+from betfair.helper import get_dir
+
+log = logging.getLogger(__name__)
+
+RECORD_DIR = get_dir('recordings')
+RECORD_ROTATE_BYTES = 200 * 1024 * 1024  # uncompressed bytes per file
+RECORD_ROTATE_MINUTES = 60
+RECORD_MAX_FILES = None  # oldest files are deleted beyond this, None keeps everything
+RECORD_COMPRESS_LEVEL = 1  # cheap compression, the recorder runs on the stream thread
+
+
+class StreamRecorder:
+    """
+    Appends raw stream payloads with their receive time to gzipped files.
+
+    Each line is '<receive epoch seconds>\\t<raw payload>'. A new file is started
+    once rotate_bytes of payload were written or rotate_minutes have passed.
+
+    """
+
+    def __init__(self, directory=RECORD_DIR, prefix='stream', rotate_bytes=RECORD_ROTATE_BYTES,
+                 rotate_minutes=RECORD_ROTATE_MINUTES, max_files=RECORD_MAX_FILES):
+        self.directory = directory
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_minutes * 60
+        self.max_files = max_files
+        self.records = 0
+        self.filename = None
+        self._file = None
+        self._bytes = 0
+        self._opened = 0.
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, raw_data, received=None):
+        if received is None:
+            received = time.time()
+        if self._file is None or self._bytes >= self.rotate_bytes or received - self._opened >= self.rotate_seconds:
+            self._rotate(received)
+        line = f"{received:.6f}\t{raw_data}\n"
+        self._file.write(line)
+        self._bytes += len(line)
+        self.records += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotate(self, now):
+        self.close()
+        stamp = datetime.fromtimestamp(now).strftime('%Y%m%d_%H%M%S_%f')
+        self.filename = os.path.join(self.directory, f"{self.prefix}_{stamp}.txt.gz")
+        self._file = gzip.open(self.filename, 'at', compresslevel=RECORD_COMPRESS_LEVEL, encoding='utf-8')
+        self._bytes = 0
+        self._opened = now
+        log.info(f"Recording stream to {self.filename}")
+
+        if self.max_files:
+            files = sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}_*.txt.gz")))
+            for old_file in files[:-self.max_files]:
+                os.remove(old_file)
+
+
+def read_recording(path):
+    """
+    Yield (receive time, raw payload) from a recording.
+
+    Plain files with one raw payload per line are accepted too, their receive
+    time is None. A gzip file that was not closed, e.g. after a crash, is read
+    up to where it was cut off.
+
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    records = 0
+    with opener(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                line = line.rstrip('\n')
+                if not line:
+                    continue
+                records += 1
+                if line[0] == '{':
+                    yield None, line
+                else:
+                    received, raw_data = line.split('\t', 1)
+                    yield float(received), raw_data
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            log.warning(f"Recording {path} is truncated after {records} records, stopped reading: {e}")
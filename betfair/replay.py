@@ -0,0 +1,113 @@
+"""
+Replay recorded stream payloads through HorseRaceListener.
+
+Feeds recordings made by betfair.recorder into a fresh listener, either at
+recorded speed or as fast as possible, and reports throughput and per stage
+timing. Used to reproduce a race day and as the stream throughput benchmark.
+
+Usage:
+    python -m betfair.replay recording.txt.gz [more files ...] [--realtime] [--speed 2]
+"""
+import argparse
+import heapq
+import json
+import time
+from datetime import datetime
+
+import pytz
+
+from betfair.recorder import read_recording
+from betfair.streamer import HorseRaceListener
+
+
+def build_race_dict(paths):
+    """Market metadata needed by the listener, taken from the marketDefinitions in the recordings."""
+    race_dict = {}
+    for path in paths:
+        for _, raw_data in read_recording(path):
+            if 'marketDefinition' not in raw_data:
+                continue
+            for market_change in json.loads(raw_data).get('mc', []):
+                definition = market_change.get('marketDefinition')
+                if not definition or market_change['id'] in race_dict:
+                    continue
+                start_time = datetime.fromisoformat(definition['marketTime'].replace('Z', '+00:00'))
+                race_dict[market_change['id']] = {
+                    'start_time': start_time.astimezone(pytz.utc),
+                    'runners': definition.get('runners', []),
+                    'event': {'countryCode': definition.get('countryCode'), 'venue': definition.get('venue')},
+                    'fullTitle': f"{definition.get('venue')} {definition.get('countryCode')}",
+                    'marketName': definition.get('name', ''),
+                    'market_type': definition.get('marketType'),
+                    'event_type': {'id': definition.get('eventTypeId')},
+                    'totalMatched': 0}
+    return race_dict
+
+
+def merge_recordings(paths):
+    """
+    Yield (receive time, raw payload) of all recordings in receive order.
+
+    Each connection of the pool records its own files, a race day is the merge
+    of them. Plain files without receive times sort first, in file order.
+
+    """
+    return heapq.merge(*(read_recording(path) for path in paths), key=lambda record: record[0] or 0.)
+
+
+def replay(paths, realtime=False, speed=1.):
+    """Feed the recordings into a new listener and return it together with the run statistics."""
+    race_dict = build_race_dict(paths)
+    listener = HorseRaceListener({}, set(race_dict), race_dict, {}, {}, {})
+    listener.recorder = None  # never re-record a replay
+
+    messages = 0
+    busy = 0.
+    first_received = None
+    wall_start = time.perf_counter()
+    for received, raw_data in merge_recordings(paths):
+        if realtime and received is not None:
+            if first_received is None:
+                first_received = received
+            delay = (received - first_received) / speed - (time.perf_counter() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        started = time.perf_counter()
+        listener.on_data(raw_data)
+        busy += time.perf_counter() - started
+        messages += 1
+
+    stats = {'messages': messages,
+             'markets': len(race_dict),
+             'wall_seconds': time.perf_counter() - wall_start,
+             'listener_seconds': busy,
+             'messages_per_second': messages / busy if busy else 0.,
+             'stage_seconds': dict(listener.stage_times),
+             'latency': listener.latency.summary(markets=False),
+             **listener.conflation_stats()}
+    return listener, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recordings', nargs='+')
+    parser.add_argument('--realtime', action='store_true', help='replay at recorded speed instead of max speed')
+    parser.add_argument('--speed', type=float, default=1., help='speed multiplier for --realtime')
+    args = parser.parse_args()
+
+    _, stats = replay(args.recordings, args.realtime, args.speed)
+    messages = max(stats['messages'], 1)
+    print(f"{stats['messages']} messages for {stats['markets']} markets in {stats['wall_seconds']:.2f}s wall, "
+          f"{stats['listener_seconds']:.2f}s in listener: {stats['messages_per_second']:,.0f} msg/s")
+    for stage, seconds in stats['stage_seconds'].items():
+        print(f"  {stage:<10} {seconds * 1000:>10.1f} ms  {seconds / messages * 1e6:>8.2f} us/msg")
+    for name in ('decode', 'apply'):
+        latency = stats['latency'][name]
+        if latency['count']:
+            print(f"  {name:<10} p50 {latency['p50']:.2f} ms  p99 {latency['p99']:.2f} ms  max {latency['max']:.2f} ms")
+    print(f"  runner changes {stats['runner_changes']}, market recomputes {stats['market_recomputes']}, "
+          f"saved by conflation {stats['market_recomputes_saved']}")
+
+
+if __name__ == '__main__':
+    main()
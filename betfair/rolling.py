@@ -0,0 +1,111 @@
+"""Rolling window statistics for streamed runner prices."""
+import time
+from array import array
+from collections import deque
+
+
+class RollingWindow:
+    """
+    Ring buffer of the most recent price samples with O(1) mean, min and max.
+
+    Samples live in a preallocated array. The running sum is kept incrementally
+    and min/max come from monotonic queues of sample sequence numbers, so an
+    append never rescans the window.
+
+    Args:
+        maxlen (int): maximum number of samples kept in the window.
+        max_age (float): optional age limit in seconds. Older samples are evicted
+                         on append, but the newest sample is always kept.
+
+    """
+
+    __slots__ = ('maxlen', 'max_age', '_values', '_times', '_start', '_end', '_sum', '_mins', '_maxs')
+
+    def __init__(self, maxlen=1000, max_age=None):
+        if maxlen < 1:
+            raise ValueError("maxlen must be at least 1")
+        self.maxlen = maxlen
+        self.max_age = max_age
+        self._values = array('d', bytes(8 * maxlen))
+        self._times = array('d', bytes(8 * maxlen))
+        self._start = 0  # sequence number of the oldest sample
+        self._end = 0  # sequence number the next sample will get
+        self._sum = 0.0
+        self._mins = deque()  # sequence numbers with increasing values
+        self._maxs = deque()  # sequence numbers with decreasing values
+
+    def append(self, value, timestamp=None):
+        """Add a sample, evicting by count and age as configured."""
+        if timestamp is None:
+            timestamp = time.time()
+        if self._end - self._start == self.maxlen:
+            self._evict()
+
+        values = self._values
+        seq = self._end
+        pos = seq % self.maxlen
+        values[pos] = value
+        self._times[pos] = timestamp
+        self._sum += value
+
+        mins = self._mins
+        while mins and values[mins[-1] % self.maxlen] >= value:
+            mins.pop()
+        mins.append(seq)
+        maxs = self._maxs
+        while maxs and values[maxs[-1] % self.maxlen] <= value:
+            maxs.pop()
+        maxs.append(seq)
+        self._end = seq + 1
+
+        if self.max_age is not None:
+            self.expire(timestamp)
+
+    def expire(self, now):
+        """Drop samples older than max_age seconds relative to now."""
+        if self.max_age is None:
+            return
+        cutoff = now - self.max_age
+        while self._end - self._start > 1 and self._times[self._start % self.maxlen] < cutoff:
+            self._evict()
+
+    def _evict(self):
+        seq = self._start
+        self._sum -= self._values[seq % self.maxlen]
+        if self._mins[0] == seq:
+            self._mins.popleft()
+        if self._maxs[0] == seq:
+            self._maxs.popleft()
+        self._start = seq + 1
+        if self._start % self.maxlen == 0:
+            # resum once per full turn of the ring so float drift can't build up
+            self._sum = sum(self)
+
+    @property
+    def mean(self):
+        count = self._end - self._start
+        return self._sum / count if count else 0.0
+
+    @property
+    def min(self):
+        return self._values[self._mins[0] % self.maxlen] if self._mins else 0.0
+
+    @property
+    def max(self):
+        return self._values[self._maxs[0] % self.maxlen] if self._maxs else 0.0
+
+    @property
+    def last(self):
+        return self._values[(self._end - 1) % self.maxlen] if self._end > self._start else 0.0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __iter__(self):
+        values = self._values
+        maxlen = self.maxlen
+        for seq in range(self._start, self._end):
+            yield values[seq % maxlen]
+
+    def __repr__(self):
+        return f"RollingWindow(len={len(self)}, mean={self.mean}, min={self.min}, max={self.max})"
@@ -0,0 +1,139 @@
+"""One Betfair session shared by streams, REST calls and orders, kept alive instead of logging in again."""
+import asyncio
+import logging
+import threading
+import time
+
+from betfairlightweight.exceptions import APIError
+
+from betfair.config import client
+
+log = logging.getLogger(__name__)
+
+KEEP_ALIVE_MINUTES = 15  # sessions expire after hours, keep alive well before
+LOGIN_RETRY_SECONDS = 60
+AUTH_ERROR_CODES = ('INVALID_SESSION_INFORMATION', 'NO_SESSION', 'NOT_AUTHORIZED')
+
+
+def api_error_code(error):
+    """errorCode of an APIError's response, None if it has none."""
+    if not isinstance(error, APIError) or not isinstance(error.response, dict):
+        return None
+    data = (error.response.get('error') or {}).get('data') or {}
+    for exception in data.values():  # APINGException, AccountAPINGException, ...
+        if isinstance(exception, dict) and 'errorCode' in exception:
+            return exception['errorCode']
+    return None
+
+
+def is_auth_error(error):
+    return api_error_code(error) in AUTH_ERROR_CODES
+
+
+class SessionManager:
+    """
+    Logs in once, calls keep alive on a schedule and logs in again only when
+    the session was rejected.
+
+    All users of the client share its session token. A call that fails with
+    an authentication error (call()) or a stream that reports one
+    (on_auth_failure()) has the session renewed once, concurrent failures
+    with the same token share that one login.
+
+    Args:
+        api_client (APIClient): betfairlightweight client
+        keep_alive_minutes (float): minutes between keep alive calls
+
+    """
+
+    def __init__(self, api_client, keep_alive_minutes=KEEP_ALIVE_MINUTES):
+        self.client = api_client
+        self.keep_alive_seconds = keep_alive_minutes * 60
+        self._lock = threading.Lock()
+        self.stats = {'logins': 0, 'login_failures': 0, 'keep_alives': 0, 'keep_alive_failures': 0,
+                      'auth_failures': 0, 'auth_seconds': 0., 'last_login': None, 'last_keep_alive': None}
+
+    @property
+    def logged_in(self):
+        return bool(self.client.session_token) and not self.client.session_expired
+
+    def login(self):
+        """Log in unless the session is valid, concurrent callers share one login."""
+        with self._lock:
+            # a caller that held the lock before may have logged in already
+            if self.logged_in:
+                return
+            self._login()
+
+    def _login(self):
+        started = time.perf_counter()
+        try:
+            self.client.login_interactive()
+        except Exception:
+            self.stats['login_failures'] += 1
+            raise
+        finally:
+            self.stats['auth_seconds'] += time.perf_counter() - started
+        self.stats['logins'] += 1
+        self.stats['last_login'] = time.time()
+        log.info(f"Logged in to Betfair, {self.stats['logins']} logins")
+
+    def keep_alive(self):
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                self.client.keep_alive()
+            except Exception as e:
+                self.stats['keep_alive_failures'] += 1
+                log.warning(f"Keep alive failed, logging in again: {e}")
+                self._login()
+                return
+            finally:
+                self.stats['auth_seconds'] += time.perf_counter() - started
+            self.stats['keep_alives'] += 1
+            self.stats['last_keep_alive'] = time.time()
+
+    def on_auth_failure(self, token):
+        """Renew a session rejected with token, unless another caller already did."""
+        with self._lock:
+            self.stats['auth_failures'] += 1
+            if self.client.session_token != token:
+                return
+            log.warning("Session rejected, logging in again")
+            self._login()
+
+    def call(self, function, *args, **kwargs):
+        """function(*args, **kwargs), retried once after renewing the session on an authentication error."""
+        token = self.client.session_token
+        try:
+            return function(*args, **kwargs)
+        except APIError as e:
+            if not is_auth_error(e):
+                raise
+        self.on_auth_failure(token)
+        return function(*args, **kwargs)
+
+    async def ensure(self):
+        """Log in unless the session is valid, does not touch the network otherwise."""
+        if not self.logged_in:
+            await asyncio.get_running_loop().run_in_executor(None, self.login)
+
+    async def run(self):
+        """Keep the session alive, logging in first and whenever that fails."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await self.ensure()
+            except Exception as e:
+                log.critical(f"Betfair login failed, trying again in {LOGIN_RETRY_SECONDS} s: {e}")
+                await asyncio.sleep(LOGIN_RETRY_SECONDS)
+                continue
+            await asyncio.sleep(self.keep_alive_seconds)
+            try:
+                await loop.run_in_executor(None, self.keep_alive)
+            except Exception as e:
+                log.critical(f"Betfair login failed, trying again in {LOGIN_RETRY_SECONDS} s: {e}")
+                await asyncio.sleep(LOGIN_RETRY_SECONDS)
+
+
+session_manager = SessionManager(client)
@@ -0,0 +1,72 @@
+"""Versioned immutable market snapshots published by the stream thread."""
+import threading
+import time
+from types import MappingProxyType
+
+
+class MarketSnapshot:
+    """
+    State of one market after a market change was applied.
+
+    Snapshots are never modified after publication: a new market change produces
+    a new snapshot. Runner dicts of runners that did not change are shared with
+    the previous version, so they must be treated as read only as well.
+
+    """
+
+    __slots__ = ('market_id', 'version', 'published', 'start_time', 'market', 'runners')
+
+    def __init__(self, market_id, version, start_time, market, runners):
+        self.market_id = market_id
+        self.version = version
+        self.published = time.time()
+        self.start_time = start_time  # epoch seconds
+        self.market = MappingProxyType(market)
+        self.runners = MappingProxyType(runners)
+
+    def seconds_to_start(self, now=None):
+        return self.start_time - (time.time() if now is None else now)
+
+    def __repr__(self):
+        return f"MarketSnapshot({self.market_id}, version={self.version}, runners={len(self.runners)})"
+
+
+class SnapshotStore:
+    """
+    Latest snapshot per market.
+
+    Writers replace the whole mapping (copy on write) under a lock, readers take
+    the current mapping with a single attribute read and can iterate it freely
+    while new versions are published.
+
+    """
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self.snapshots = MappingProxyType({})
+
+    def get(self, market_id):
+        return self.snapshots.get(market_id)
+
+    def publish(self, snapshot):
+        with self._write_lock:
+            snapshots = dict(self.snapshots)
+            snapshots[snapshot.market_id] = snapshot
+            self.snapshots = MappingProxyType(snapshots)
+
+    def remove(self, market_id):
+        with self._write_lock:
+            if market_id not in self.snapshots:
+                return
+            snapshots = dict(self.snapshots)
+            del snapshots[market_id]
+            self.snapshots = MappingProxyType(snapshots)
+
+
+def build_snapshot(previous, market_state, changed_runners):
+    """New snapshot of a MarketState, converting only the runners that changed."""
+    runners = dict(previous.runners) if previous is not None else {}
+    for runner in changed_runners:
+        runners[runner.runner_id] = runner.to_dict()
+    version = previous.version + 1 if previous is not None else 1
+    return MarketSnapshot(market_state.market_id, version, market_state.start_time, market_state.to_dict(), runners)
@@ -0,0 +1,192 @@
+"""Typed market and runner state kept by the stream listener."""
+import re
+import sys
+
+from betfair.orderbook import RunnerBook
+from betfair.overround import MarketOverround
+from betfair.rolling import RollingWindow
+from betfair.volume import TradedVolume
+
+# per runner price history used for moving averages and min/max
+PRICE_HISTORY_MAXLEN = 1000
+PRICE_HISTORY_MAX_AGE = None  # seconds, None keeps samples until maxlen pushes them out
+
+
+def clean_runner_name(runner_name):
+    """Strip the saddle cloth number ('3. Name' -> 'Name')."""
+    return re.sub(r'^\d+\.\s+', '', runner_name) if runner_name else runner_name
+
+
+class RunnerState:
+    """
+    Prices, ladders and derived features of one runner.
+
+    Written by the stream thread only, readers use the snapshot built from
+    to_dict().
+
+    """
+
+    __slots__ = ('runner_id', 'selection_id', 'name', 'horse_info',
+                 'back', 'lay', 'last', 'delta_back', 'delta_lay', 'delta_last',
+                 'volume', 'traded_vwap', 'recent_volume',
+                 'wom', 'microprice', 'spread_ticks', 'depth_imbalance', 'back_vwap', 'lay_vwap',
+                 'back_history', 'lay_history', 'last_history', 'book', 'traded')
+
+    def __init__(self, runner_id, selection_id, name=None):
+        self.runner_id = runner_id
+        self.selection_id = selection_id
+        self.name = name
+        self.horse_info = None
+        self.back = 0.
+        self.lay = 0.
+        self.last = 0.
+        # values set by the latest change only, None if the change did not touch them
+        self.delta_back = None
+        self.delta_lay = None
+        self.delta_last = None
+        self.volume = 0.
+        self.traded_vwap = 0.
+        self.recent_volume = 0.
+        self.wom = None
+        self.microprice = None
+        self.spread_ticks = None
+        self.depth_imbalance = None
+        self.back_vwap = None
+        self.lay_vwap = None
+        self.back_history = RollingWindow(PRICE_HISTORY_MAXLEN, PRICE_HISTORY_MAX_AGE)
+        self.lay_history = RollingWindow(PRICE_HISTORY_MAXLEN, PRICE_HISTORY_MAX_AGE)
+        self.last_history = RollingWindow(PRICE_HISTORY_MAXLEN, PRICE_HISTORY_MAX_AGE)
+        self.book = RunnerBook()
+        self.traded = TradedVolume()
+
+    def to_dict(self):
+        """Runner fields under the keys used by strategies and the UI."""
+        back_history = self.back_history
+        lay_history = self.lay_history
+        last_history = self.last_history
+        return {
+            '_runner_name': self.name,
+            'back': self.back,
+            'lay': self.lay,
+            'last': self.last,
+            'volume': self.volume,
+            'traded_vwap': self.traded_vwap,
+            'recent_volume': self.recent_volume,
+            'wom': self.wom,
+            'microprice': self.microprice,
+            'spread_ticks': self.spread_ticks,
+            'depth_imbalance': self.depth_imbalance,
+            'back_vwap': self.back_vwap,
+            'lay_vwap': self.lay_vwap,
+            '_back_moving_avg': back_history.mean,
+            '_back_min': back_history.min,
+            '_back_max': back_history.max,
+            '_lay_moving_avg': lay_history.mean,
+            '_lay_min': lay_history.min,
+            '_lay_max': lay_history.max,
+            '_last_moving_avg': last_history.mean,
+            '_last_min': last_history.min,
+            '_last_max': last_history.max,
+            '_horse_info': self.horse_info,
+        }
+
+    def memory_usage(self):
+        """Approximate bytes held by this runner, including ladders and price history."""
+        size = sys.getsizeof(self)
+        for window in (self.back_history, self.lay_history, self.last_history):
+            size += (sys.getsizeof(window) + sys.getsizeof(window._values) + sys.getsizeof(window._times)
+                     + sys.getsizeof(window._mins) + sys.getsizeof(window._maxs))
+        size += sys.getsizeof(self.book) + sys.getsizeof(self.book.back_sizes) + sys.getsizeof(self.book.lay_sizes)
+        size += sys.getsizeof(self.traded) + sys.getsizeof(self.traded.sizes) + sys.getsizeof(self.traded._recent)
+        return size
+
+
+class MarketState:
+    """
+    State of one streamed market.
+
+    Prices and aggregates are written by the stream thread. strategy_status,
+    runner_status and orders belong to the strategy handler and are only
+    touched on the event loop.
+
+    """
+
+    __slots__ = ('market_id', 'runners', 'runner_index', 'overround',
+                 'back_overrun', 'lay_overrun', 'last_overrun', 'race_title', 'start_time', 'race_start_time',
+                 'strategy_status', 'runner_status', 'orders')
+
+    def __init__(self, market_id):
+        self.market_id = market_id
+        self.runners = []
+        self.runner_index = {}  # runner id -> position in runners
+        self.overround = MarketOverround()
+        self.back_overrun = 0.
+        self.lay_overrun = 0.
+        self.last_overrun = 0.
+        self.race_title = None
+        self.start_time = None  # epoch seconds
+        self.race_start_time = None  # iso format
+        self.strategy_status = {}  # strategy name -> comment
+        self.runner_status = {}  # runner id -> comment
+        self.orders = []
+
+    def runner(self, runner_id, selection_id, runnerid_name_dict):
+        """Runner state for runner_id, created on first use."""
+        i = self.runner_index.get(runner_id)
+        if i is None:
+            runner = RunnerState(runner_id, selection_id)
+            self.runner_index[runner_id] = len(self.runners)
+            self.runners.append(runner)
+        else:
+            runner = self.runners[i]
+        if runner.name is None:  # metadata might arrive after the first prices
+            runner.name = clean_runner_name(runnerid_name_dict.get(selection_id))
+        return runner
+
+    def get_runner(self, runner_id):
+        i = self.runner_index.get(runner_id)
+        return self.runners[i] if i is not None else None
+
+    def to_dict(self):
+        """Market level fields under the keys used by strategies and the UI."""
+        return {
+            '_back_overrun': self.back_overrun,
+            '_lay_overrun': self.lay_overrun,
+            '_last_overrun': self.last_overrun,
+            '_race_title': self.race_title,
+            '_race_start_time': self.race_start_time,
+        }
+
+    def memory_usage(self):
+        runner_bytes = sum(runner.memory_usage() for runner in self.runners)
+        total = (sys.getsizeof(self) + sys.getsizeof(self.runners) + sys.getsizeof(self.runner_index)
+                 + sys.getsizeof(self.overround) + runner_bytes)
+        return {'runners': len(self.runners),
+                'bytes': total,
+                'bytes_per_runner': runner_bytes / len(self.runners) if self.runners else 0}
+
+
+def memory_report(ff_cache):
+    """Memory usage per market and in total."""
+    markets = {market_id: market.memory_usage() for market_id, market in list(ff_cache.items())}
+    return {'markets': markets,
+            'total_bytes': sum(market['bytes'] for market in markets.values()),
+            'total_runners': sum(market['runners'] for market in markets.values())}
+
+
+def market_payload(snapshot, market_state=None):
+    """
+    Websocket representation of a market: the published snapshot plus the
+    strategy status and orders kept on the MarketState by the strategy handler.
+    """
+    runner_status = market_state.runner_status if market_state is not None else {}
+    payload = {runner_id: {**runner, '_strategy_status': runner_status.get(runner_id, {})}
+               for runner_id, runner in snapshot.runners.items()}
+    payload.update(snapshot.market)
+    payload['_seconds_to_start'] = snapshot.seconds_to_start()
+    if market_state is not None:
+        payload['_strategy_status'] = dict(market_state.strategy_status)
+        payload['_orders'] = list(market_state.orders)
+    else:
+        payload['_strategy_status'] = {}
+    return payload
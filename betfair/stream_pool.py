@@ -0,0 +1,399 @@
+"""Pool of Betfair stream connections sharing the subscribed markets between them."""
+import logging
+import threading
+import time
+from collections import deque
+
+from betfairlightweight.filters import streaming_market_data_filter, streaming_market_filter
+
+from betfair.latency import format_summary
+from betfair.session import AUTH_ERROR_CODES
+
+log = logging.getLogger(__name__)
+
+STREAM_CONNECTIONS = 4  # the default app key allows 10 concurrent stream connections
+MAX_MARKETS_PER_STREAM = 200  # default market subscription limit of a connection
+REBALANCE_TOLERANCE = 10  # markets a connection may have above the least loaded one before some are moved
+STREAM_POOL_UPDATE_SECONDS = 30
+RECONNECT_MIN_SECONDS = 2
+RECONNECT_MAX_SECONDS = 30
+STREAM_HEARTBEAT_MS = 5000
+STREAM_SESSION_HISTORY = 20  # sessions kept per connection for stats
+
+
+def market_data_filter():
+    return streaming_market_data_filter(
+        fields=['EX_MARKET_DEF', 'EX_ALL_OFFERS', 'EX_TRADED'],
+        ladder_levels=3
+    )
+
+
+class StreamSession:
+    """
+    Statistics of one market subscription of a connection.
+
+    Args:
+        number (int): session number on its connection
+        kind (str): 'full' (new subscription with a full image), 'resumed'
+                    (reconnect with initialClk/clk, deltas only) or 'in_place'
+                    (changed market filter sent on the open socket)
+        gap_started (float): epoch seconds the previous session lost its socket, None without a gap
+
+    """
+
+    __slots__ = ('number', 'kind', 'markets', 'started', 'gap_started', 'downtime', 'messages',
+                 'image_bytes', 'image_messages', 'image_markets', 'image_seconds', 'resub_bytes',
+                 'ended', 'end_reason')
+
+    def __init__(self, number, kind, markets, gap_started=None):
+        self.number = number
+        self.kind = kind
+        self.markets = markets
+        self.started = time.time()
+        self.gap_started = gap_started
+        self.downtime = None  # seconds from losing the socket to the first message of this session
+        self.messages = 0
+        self.image_bytes = 0
+        self.image_messages = 0
+        self.image_markets = 0
+        self.image_seconds = None  # seconds until the (segmented) image was complete
+        self.resub_bytes = 0
+        self.ended = None
+        self.end_reason = None
+
+    def on_message(self, message, size):
+        """Called by the listener for every message received in this session."""
+        if not self.messages and self.gap_started is not None:
+            self.downtime = time.time() - self.gap_started
+        self.messages += 1
+        ct = message.ct
+        if ct == 'SUB_IMAGE':
+            self.image_bytes += size
+            self.image_messages += 1
+            self.image_markets += len(message.markets)
+            if message.segment_type in (None, 'SEG_END'):
+                self.image_seconds = time.time() - self.started
+        elif ct == 'RESUB_DELTA':
+            self.resub_bytes += size
+
+    def end(self, reason):
+        self.ended = time.time()
+        self.end_reason = reason
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class StreamConnection:
+    """
+    One stream socket with its own listener and reader thread.
+
+    The reader thread subscribes to the connection's markets and blocks in
+    stream.start(), the listener processes every message on that thread.
+
+    Changed market sets are sent as a new subscription on the open socket.
+    Markets that only dropped out are filtered by the listener and stay in the
+    subscription until markets need to be added, which saves an image resend
+    whenever a race finishes. A lost socket is reopened with exponential backoff
+    and, if the market set did not change meanwhile, resumed with the last
+    initialClk/clk so the exchange only replays the missed deltas.
+
+    Args:
+        name (str): name used in logs and stats
+        client: betfairlightweight APIClient
+        listener: HorseRaceListener of this connection, its race_ids are replaced by the shard
+        data_filter (dict): market data filter of the subscription
+        session_manager (SessionManager): renews the session when the stream rejects it
+
+    """
+
+    def __init__(self, name, client, listener, data_filter, session_manager=None):
+        self.name = name
+        self.client = client
+        self.session_manager = session_manager
+        self.listener = listener
+        if listener.recorder is not None:
+            listener.recorder.prefix = f'stream-{name}'  # one file series per connection
+        self.data_filter = data_filter
+        self.market_ids = frozenset()
+        self.subscribed_ids = frozenset()
+        self.stream = None
+        self.thread = None
+        self.reconnects = 0
+        self.connected_since = None
+        self.session_counts = dict.fromkeys(('full', 'resumed', 'in_place'), 0)
+        self.sessions = deque(maxlen=STREAM_SESSION_HISTORY)
+        self.downtime = 0.  # seconds without a socket between sessions, of ended sessions
+        self._gap_started = None
+        self._lock = threading.Lock()  # serialises subscriptions of the reader thread and update()
+        self._stop = threading.Event()
+        self._sampled_at = time.monotonic()
+        self._sampled_messages = 0
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def restrict(self, market_ids):
+        """Stop processing markets outside market_ids straight away."""
+        self.listener.race_ids = self.market_ids & frozenset(market_ids)
+        self.listener.decoder.prune(self.listener.race_ids)
+
+    def update(self, market_ids):
+        """Switch the connection to market_ids, without reconnecting."""
+        self.market_ids = frozenset(market_ids)
+        # the listener drops messages of markets outside its shard
+        self.listener.race_ids = self.market_ids
+        self.listener.decoder.prune(self.market_ids)
+        if not self.market_ids:
+            self.stop()  # an empty market filter would subscribe to every market
+            return
+        if not self.running:
+            self.start()
+            return
+        if self.market_ids <= self.subscribed_ids:
+            return  # finished markets stay subscribed until new ones come
+        with self._lock:
+            stream = self.stream
+            if stream is None or not stream.running:
+                return  # the reader thread subscribes the new markets when it reconnects
+            self._subscribe(stream, 'in_place')
+
+    def start(self):
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, name=f'stream-{self.name}', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        stream = self.stream
+        if stream is not None:
+            stream.stop()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.thread = None
+        if self.listener.recorder is not None:
+            self.listener.recorder.close()  # a gzip file is only readable to the end once closed
+        self.stream = None
+        self.connected_since = None
+        self.subscribed_ids = frozenset()
+        self.listener.reset_clk()
+        self._end_session('stopped')
+        self._gap_started = None
+
+    def _subscribe(self, stream, kind):
+        """Send the subscription for market_ids, kind is 'full', 'resumed' or 'in_place'."""
+        listener = self.listener
+        if kind == 'resumed':
+            initial_clk, clk = listener.last_initial_clk, listener.last_clk
+        else:
+            initial_clk = clk = None
+            listener.reset_clk()
+        self._end_session('resubscribed' if kind == 'in_place' else 'reconnected')
+        session = StreamSession(sum(self.session_counts.values()) + 1, kind, len(self.market_ids),
+                                None if kind == 'in_place' else self._gap_started)
+        self.sessions.append(session)
+        self.session_counts[kind] += 1
+        listener.session = session
+        stream.subscribe_to_markets(
+            market_filter=streaming_market_filter(market_ids=list(self.market_ids)),
+            market_data_filter=self.data_filter,
+            initial_clk=initial_clk,
+            clk=clk,
+            heartbeat_ms=STREAM_HEARTBEAT_MS)
+        self.subscribed_ids = self.market_ids
+        log.info(f"Stream {self.name} {kind} subscription to {len(self.market_ids)} markets")
+
+    def _end_session(self, reason):
+        session = self.listener.session
+        if session is None or session.ended is not None:
+            return
+        session.end(reason)
+        if session.downtime is not None:
+            self.downtime += session.downtime
+
+    def _run(self):
+        delay = RECONNECT_MIN_SECONDS
+        while not self._stop.is_set():
+            token = self.client.session_token  # the stream authenticates with it when it connects
+            self.listener.last_error_code = None
+            try:
+                stream = self.client.streaming.create_stream(listener=self.listener)
+                with self._lock:
+                    if self._stop.is_set():
+                        break
+                    self.stream = stream
+                    listener = self.listener
+                    can_resume = (self.market_ids == self.subscribed_ids
+                                  and listener.last_initial_clk and listener.last_clk)
+                    self._subscribe(stream, 'resumed' if can_resume else 'full')
+                self.connected_since = time.time()
+                delay = RECONNECT_MIN_SECONDS
+                stream.start()  # blocks until stop() or a socket error
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                self.reconnects += 1
+                self.connected_since = None
+                session = self.listener.session
+                if self._gap_started is None or (session is not None and session.messages):
+                    self._gap_started = time.time()  # failed retries keep the start of the gap
+                self._end_session(f'error: {e}')
+                log.error(f"Stream {self.name} failed: {e}. Reconnecting in {delay}s")
+                if self.session_manager is not None and self.listener.last_error_code in AUTH_ERROR_CODES:
+                    try:
+                        self.session_manager.on_auth_failure(token)
+                    except Exception as login_error:
+                        log.error(f"Stream {self.name} could not renew the session: {login_error}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+    def stats(self):
+        """
+        Message rate and maximum publish time lag since the sample started,
+        lag and subscription sessions. Reading them leaves the sample as it is.
+        """
+        now = time.monotonic()
+        listener = self.listener
+        messages = listener.messages_processed
+        elapsed = now - self._sampled_at
+        rate = (messages - self._sampled_messages) / elapsed if elapsed > 0 else 0.
+        downtime = self.downtime
+        session = listener.session
+        if session is not None and session.ended is None and session.downtime is not None:
+            downtime += session.downtime
+        return {'markets': len(self.market_ids),
+                'subscribed_markets': len(self.subscribed_ids),
+                'running': self.running,
+                'connected_seconds': time.time() - self.connected_since if self.connected_since else 0.,
+                'messages': messages,
+                'messages_per_second': rate,
+                'lag': listener.last_lag,
+                'max_lag': listener.max_lag,
+                'reconnects': self.reconnects,
+                'downtime_seconds': downtime,
+                'sessions': dict(self.session_counts),
+                'last_sessions': [session.to_dict() for session in self.sessions]}
+
+    def start_sample(self):
+        """Start a new sample of the message rate and maximum lag."""
+        self._sampled_at = time.monotonic()
+        self._sampled_messages = self.listener.messages_processed
+        self.listener.max_lag = 0.
+
+
+class StreamPool:
+    """
+    Shards the subscribed markets over several StreamConnections.
+
+    Markets stay on their connection while they are subscribed. New markets go to
+    the least loaded connection with capacity, and markets are only moved when a
+    connection has more than REBALANCE_TOLERANCE markets above the least loaded
+    one. A moved market is resent as a full image by its new connection. All
+    listeners write into the same market state, a market is only ever owned by
+    one connection.
+
+    Args:
+        client: betfairlightweight APIClient
+        listener_factory: callable returning a new HorseRaceListener on the shared state
+        connections (int): number of stream connections
+        max_markets (int): market subscription limit per connection
+        data_filter (dict): market data filter, market_data_filter() by default
+        session_manager (SessionManager): renews the session when a stream rejects it
+
+    """
+
+    def __init__(self, client, listener_factory, connections=STREAM_CONNECTIONS,
+                 max_markets=MAX_MARKETS_PER_STREAM, data_filter=None, session_manager=None):
+        data_filter = data_filter or market_data_filter()
+        self.max_markets = max_markets
+        self.connections = [StreamConnection(str(i), client, listener_factory(), data_filter, session_manager)
+                            for i in range(connections)]
+        self.unassigned = set()
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        return len(self.connections) * self.max_markets
+
+    def update(self, market_ids):
+        """
+        Stream exactly market_ids across the pool.
+
+        Blocking: subscriptions are sent on the connections' sockets, run it in an
+        executor when called from the event loop.
+
+        """
+        with self._lock:
+            shards = self.plan(market_ids)
+            # drop moved markets from their old connection before another one subscribes them
+            for connection, shard in zip(self.connections, shards):
+                connection.restrict(shard)
+            for connection, shard in zip(self.connections, shards):
+                if shard != connection.market_ids or (shard and not connection.running):
+                    log.info(f"Stream {connection.name}: {len(shard)} markets "
+                             f"(+{len(shard - connection.market_ids)} -{len(connection.market_ids - shard)})")
+                    connection.update(shard)
+
+    def plan(self, market_ids):
+        """Market ids per connection after adding new, dropping finished and rebalancing markets."""
+        market_ids = set(market_ids)
+        shards = [set(connection.market_ids & market_ids) for connection in self.connections]
+        assigned = set().union(*shards)
+
+        self.unassigned = set()
+        for market_id in sorted(market_ids - assigned):
+            shard = min(shards, key=len)
+            if len(shard) >= self.max_markets:
+                self.unassigned.add(market_id)
+                continue
+            shard.add(market_id)
+        if self.unassigned:
+            log.warning(f"Stream pool is full, {len(self.unassigned)} markets are not subscribed")
+
+        while True:
+            largest = max(shards, key=len)
+            smallest = min(shards, key=len)
+            if len(largest) - len(smallest) <= REBALANCE_TOLERANCE:
+                break
+            market_id = max(largest)
+            largest.remove(market_id)
+            smallest.add(market_id)
+        return [frozenset(shard) for shard in shards]
+
+    def stop(self):
+        with self._lock:
+            for connection in self.connections:
+                connection.stop()
+
+    def stats(self):
+        return {connection.name: connection.stats() for connection in self.connections}
+
+    def latency(self, markets=True, reset=False):
+        """Latency histogram summaries per connection, optionally starting new histograms."""
+        summaries = {}
+        for connection in self.connections:
+            latency = connection.listener.latency
+            summaries[connection.name] = latency.summary(markets)
+            if reset:
+                latency.reset()
+        return summaries
+
+    def log_latency(self):
+        """Log the latency of every connection since the previous call and start new histograms."""
+        for name, summary in self.latency(markets=False, reset=True).items():
+            if summary['network']['count'] or summary['decode']['count']:
+                log.info(f"Stream {name} latency: {format_summary(summary)}")
+
+    def log_stats(self):
+        """Log the stats of every connection and start new samples, each log line covers the time since the last."""
+        for connection in self.connections:
+            stats = connection.stats()
+            connection.start_sample()
+            name = connection.name
+            if not stats['markets']:
+                continue
+            log.info(f"Stream {name}: {stats['markets']} markets, {stats['messages_per_second']:.1f} msg/s, "
+                     f"lag {stats['lag'] * 1000:.0f} ms (max {stats['max_lag'] * 1000:.0f} ms), "
+                     f"{stats['reconnects']} reconnects, {stats['downtime_seconds']:.1f}s down, "
+                     f"sessions {stats['sessions']}")
@@ -1,14 +1,15 @@
-import json
 import logging
-import re
-from collections import deque
+import time
 from datetime import datetime
 
-import numpy as np
-import pytz
 from betfairlightweight import StreamListener
 
-from betfair.config import tickdata_collection
+from betfair.decoder import StreamDecoder
+from betfair.features import update_book_features
+from betfair.latency import FeedLatency
+from betfair.recorder import StreamRecorder
+from betfair.snapshot import SnapshotStore, build_snapshot
+from betfair.state import MarketState
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -19,173 +20,247 @@ SECS_TO_START_FILTER = MINS_TO_START_FILTER * 60
 SECS_MAX_RACE_DURATION = MINS_MAX_RACE_DURATION * 60
 
 
-SAVE_TICKDATA_TO_MONGO = False
+SAVE_TICKDATA_TO_MONGO = False  # main passes one TickDataWriter to the listeners of all connections
+RECORD_STREAM = False  # raw payloads to betfair.recorder files, for replay and benchmarks
 
 
 class HorseRaceListener(StreamListener):
-    def __init__(self, ff_cache, race_ids, last_cache, race_dict, punters_com_au, horse_info_dict, runnerid_name_dict):
+    def __init__(self, ff_cache, race_ids, race_dict, punters_com_au, horse_info_dict, runnerid_name_dict,
+                 snapshots=None, trigger=None, tick_writer=None):
         super().__init__()
+        self.snapshots = snapshots if snapshots is not None else SnapshotStore()
+        self.trigger = trigger  # trigger.MarketTrigger woken for every market with a new snapshot
         self.ff_cache = ff_cache
         self.race_ids = race_ids
-        self.last_cache = last_cache
         self.race_dict = race_dict
         self.punters_com_au = punters_com_au
         self.horse_info_dict = horse_info_dict
         self.runnerid_name_dict = runnerid_name_dict
+        self.runner_changes_processed = 0
+        self.market_recomputes = 0
+        self.messages_processed = 0
+        self.last_lag = 0.  # seconds between publish time and processing of the latest message
+        self.max_lag = 0.
+        # subscription tokens to resume a reconnect with deltas only
+        self.last_initial_clk = None
+        self.last_clk = None
+        self.session = None  # stream_pool.StreamSession of the current subscription
+        self.last_error_code = None  # of the latest FAILURE status, the connection renews the session on auth errors
+        self.stage_times = dict.fromkeys(('decode', 'runners', 'market'), 0.)
+        self.latency = FeedLatency()
+        self.decoder = StreamDecoder()
+        self.recorder = StreamRecorder() if RECORD_STREAM else None
+        self.tick_writer = tick_writer  # tickwriter.TickDataWriter shared by the listeners of all connections
 
     def on_data(self, raw_data):
-        data = json.loads(raw_data)
-        for market_change in data.get('mc', []):
-            market_id = market_change.get('id')
-            # print (len(self.race_ids))
-            if market_id in self.race_ids:
-                race_start_time = self.race_dict[market_id]['start_time']
-                market_name = self.race_dict[market_id]['fullTitle'] +' (' +self.race_dict[market_id]['market_type']+')'
-                secs_to_start = (race_start_time -
-                                 datetime.utcnow().replace(tzinfo=pytz.utc)).total_seconds()
-                for runner_change in market_change.get('rc', []):
-                    runner_id = str(runner_change.get('id'))
-                    runner_name = self.runnerid_name_dict.get(int(runner_id))
-                    if runner_name:
-                        runner_name = re.sub(r'^\d+\.\s+', '', runner_name)
-                   # Initialize deques if they don't exist
-                    if not '_back_values' in self.ff_cache[market_id][runner_id]:
-                        self.ff_cache[market_id][runner_id]['_back_values'] = deque(
-                            maxlen=1000)
-                    if not '_lay_values' in self.ff_cache[market_id][runner_id]:
-                        self.ff_cache[market_id][runner_id]['_lay_values'] = deque(
-                            maxlen=1000)
-                    if not '_last_values' in self.ff_cache[market_id][runner_id]:
-                        self.ff_cache[market_id][runner_id]['_last_values'] = deque(
-                            maxlen=1000)
-
-                    # Update values and moving averages
-                    new_back = runner_change.get('atb')[0][0] if runner_change.get(
-                        'atb') else self.ff_cache[market_id][runner_id]['back']
-                    self.ff_cache[market_id][runner_id]['_back_values'].append(
-                        new_back)
-                    self.ff_cache[market_id][runner_id]['_runner_name'] = runner_name
-                    self.ff_cache[market_id][runner_id]['_back_moving_avg'] = sum(
-                        self.ff_cache[market_id][runner_id]['_back_values']) / len(self.ff_cache[market_id][runner_id]['_back_values'])
-
-                    new_lay = runner_change.get('atl')[0][0] if runner_change.get(
-                        'atl') else self.ff_cache[market_id][runner_id]['lay']
-                    self.ff_cache[market_id][runner_id]['_lay_values'].append(
-                        new_lay)
-                    self.ff_cache[market_id][runner_id]['_lay_moving_avg'] = sum(
-                        self.ff_cache[market_id][runner_id]['_lay_values']) / len(self.ff_cache[market_id][runner_id]['_lay_values'])
-
-                    new_last = runner_change.get('trd')[0][0] if runner_change.get(
-                        'trd') else self.ff_cache[market_id][runner_id]['last']
-                    self.ff_cache[market_id][runner_id]['_last_values'].append(
-                        new_last)
-                    self.ff_cache[market_id][runner_id]['_last_moving_avg'] = sum(
-                        self.ff_cache[market_id][runner_id]['_last_values']) / len(self.ff_cache[market_id][runner_id]['_last_values'])
-
-                    self.ff_cache[market_id][runner_id]['_back_min'] = min(
-                        self.ff_cache[market_id][runner_id]['_back_values'])
-                    self.ff_cache[market_id][runner_id]['_back_max'] = max(
-                        self.ff_cache[market_id][runner_id]['_back_values'])
-
-                    self.ff_cache[market_id][runner_id]['_lay_min'] = min(
-                        self.ff_cache[market_id][runner_id]['_lay_values'])
-                    self.ff_cache[market_id][runner_id]['_lay_max'] = max(
-                        self.ff_cache[market_id][runner_id]['_lay_values'])
-
-                    self.ff_cache[market_id][runner_id]['_last_min'] = min(
-                        self.ff_cache[market_id][runner_id]['_last_values'])
-                    self.ff_cache[market_id][runner_id]['_last_max'] = max(
-                        self.ff_cache[market_id][runner_id]['_last_values'])
-
-                    self.ff_cache[market_id][runner_id]['back'] = runner_change.get(
-                        'atb')[0][0] if runner_change.get('atb') else self.ff_cache[market_id][runner_id]['back']
-                    self.ff_cache[market_id][runner_id]['lay'] = runner_change.get(
-                        'atl')[0][0] if runner_change.get('atl') else self.ff_cache[market_id][runner_id]['lay']
-                    self.ff_cache[market_id][runner_id]['last'] = runner_change.get(
-                        'trd')[0][0] if runner_change.get('trd') else self.ff_cache[market_id][runner_id]['last']
-                    trd_value = runner_change.get('trd')
-                    if trd_value is not None:
-                        self.ff_cache[market_id][runner_id]['volume'] = trd_value[0][1] + \
-                            self.ff_cache[market_id][runner_id]['last']
-                    else:
-                        self.ff_cache[market_id][runner_id]['volume'] = self.ff_cache[market_id][runner_id]['last']
-
-                    self.last_cache[market_id][runner_id]['back'] = runner_change.get(
-                        'atb')[0][0] if runner_change.get('atb') else None
-                    self.last_cache[market_id][runner_id]['lay'] = runner_change.get(
-                        'atl')[0][0] if runner_change.get('atl') else None
-                    self.last_cache[market_id][runner_id]['last'] = runner_change.get(
-                        'trd')[0][0] if runner_change.get('trd') else None
-
-                    self.ff_cache[market_id][runner_id]['_horse_info'] = self.horse_info_dict.get(
-                        runner_name)
-
-                    self.ff_cache[market_id]['_lay_overrun'] = overrun_lay = self.get_market_sum(
-                        market_id, 'lay')
-                    self.ff_cache[market_id]['_back_overrun'] = overrun_back = self.get_market_sum(
-                        market_id, 'back')
-                    self.ff_cache[market_id]['_last_overrun'] = overrun_last = self.get_market_sum(
-                        market_id, 'last')
-                    self.ff_cache[market_id]['_seconds_to_start'] = secs_to_start
-                    self.ff_cache[market_id]['_race_title'] = market_name
-                    self.ff_cache[market_id]['_race_start_time'] = race_start_time.isoformat(
-                    )
-
-                    flattened_data = {
-                        # divide by 1000 to convert from milliseconds to seconds
-                        'pt': datetime.fromtimestamp(data.get('pt')/1000) if data.get('pt') else None,
-                        'meta': {
-                            'market_id': market_id,
-                            'runner_id': runner_id,
-                            'runner_name': runner_name,
-                            'secs_to_start': -secs_to_start
-                        },
-                        'back_odds': runner_change.get('atb')[0][0] if runner_change.get('atb') else None,
-                        'back_vol': runner_change.get('atb')[0][1] if runner_change.get('atb') else None,
-                        'lay_odds': runner_change.get('atl')[0][0] if runner_change.get('atl') else None,
-                        'lay_vol': runner_change.get('atl')[0][1] if runner_change.get('atl') else None,
-                        'traded_odds': runner_change.get('trd')[0][0] if runner_change.get('trd') else None,
-                        'traded_vol': runner_change.get('trd')[0][1] if runner_change.get('trd') else None,
-                        'back_vwap': vwap(runner_change.get('atb')) if runner_change.get('atb') else None,
-                        'lay_vwap': vwap(runner_change.get('atl')) if runner_change.get('atl') else None,
-                        'overrun_back': overrun_back if overrun_back else None,
-                        'overrun_lay': overrun_lay if overrun_lay else None,
-                        'overrun_last': overrun_last if overrun_last else None,
-                        'cumulative_volume': self.ff_cache[market_id][runner_id]['volume'] if self.ff_cache[market_id][runner_id]['volume'] else None,
-                        # 'forward_fills': self.ff_cache[market_id],
-                    }
-                    races_len = len(flattened_data)
-                    # if data.get('clk') != 'AAAAAAAA' and SECS_MAX_RACE_DURATION > flattened_data['meta']['secs_to_start'] > -SECS_TO_START_FILTER:
-                    #     print(flattened_data)
-                    if SAVE_TICKDATA_TO_MONGO:
-                        tickdata_collection.insert_one(flattened_data)
-
-    def get_market_sum(self, market_id, field_name):
-        total_sum = 0
-        for horse_id, data in self.ff_cache[market_id].items():
-            if horse_id[0] == '_':
+        received = time.time()
+        if self.recorder is not None:
+            self.recorder.record(raw_data, received)
+        stage_times = self.stage_times
+        latency = self.latency
+        started = time.perf_counter()
+        message = self.decoder.decode(raw_data, self.race_ids)
+        decoded = time.perf_counter()
+        stage_times['decode'] += decoded - started
+        latency.decode.record((decoded - started) * 1000)
+        self.messages_processed += 1
+        if self.session is not None:
+            self.session.on_message(message, len(raw_data))
+
+        if message.op != 'mcm':
+            if message.op == 'status' and message.status_code == 'FAILURE':
+                log.error(f"Stream error {message.error_code}: {message.error_message}")
+                self.last_error_code = message.error_code
+                if message.connection_closed:
+                    return False  # closes the socket, the connection reconnects
+            return
+        if message.initial_clk:
+            self.last_initial_clk = message.initial_clk
+        if message.clk:
+            self.last_clk = message.clk
+
+        # publish time keeps time based values consistent with the exchange clock (and replays)
+        if message.pt:
+            timestamp = message.pt / 1000
+            self.last_lag = lag = received - timestamp
+            if lag > self.max_lag:
+                self.max_lag = lag
+            network_ms = lag * 1000
+            latency.network.record(network_ms)
+        else:
+            timestamp = received
+            network_ms = None
+        for market_change in message.markets:
+            market_start = time.perf_counter()
+            market_id = market_change.id
+            race_start_time = self.race_dict[market_id]['start_time']
+            start_epoch = race_start_time.timestamp()
+            secs_to_start = start_epoch - timestamp
+            market = self.ff_cache.get(market_id)
+            if market is None:
+                # new market, or its state was dropped after the race: start from scratch
+                market = self.ff_cache[market_id] = MarketState(market_id)
+                previous_snapshot = None
+            else:
+                previous_snapshot = self.snapshots.get(market_id)
+            cleared_runners = None
+            if market_change.img:
+                # full image, the ladders are resent from scratch, traded sizes are replaced by apply_runner_change
+                cleared_runners = list(market.runners)
+                for runner in cleared_runners:
+                    runner.book.clear()
+
+            # phase 1: apply all runner deltas of this market change
+            phase_start = time.perf_counter()
+            changed_runners = [self.apply_runner_change(market, runner_change, timestamp, cleared_runners is not None)
+                               for runner_change in market_change.runners]
+            if cleared_runners:
+                # runners left out of the image have empty ladders now, their prices and features go with them
+                changed = set(map(id, changed_runners))
+                changed_runners.extend(self.refresh_runner(market, runner, timestamp)
+                                       for runner in cleared_runners if id(runner) not in changed)
+            removed = market_change.definition is not None and self.remove_runners(market, market_change.definition)
+            runners_done = time.perf_counter()
+            stage_times['runners'] += runners_done - phase_start
+            if not changed_runners and not removed:
                 continue
-            value = data[field_name]
-            if value:  # prevent division by zero
-                total_sum += (1 / value)
-        return total_sum
-
-
-def vwap(data):
-    """
-    Calculates the Volume Weighted Average Price (VWAP) of a given set of data.
-
-    Args:
-        data (list): A list of tuples containing price and volume data.
-
-    Returns:
-        float: The VWAP of the given data.
-    """
-    data = np.array(data)
-    prices = data[:, 0]
-    volumes = data[:, 1]
-    total_volume = np.sum(volumes)
-    if total_volume == 0:
-        return np.nan
-    res = np.sum(prices * volumes) / total_volume
-    return res
+
+            # phase 2: market level derived state, once per market change
+            self.update_market(market, start_epoch, race_start_time)
+            self.snapshots.publish(build_snapshot(previous_snapshot, market, changed_runners))
+            if self.trigger is not None:
+                self.trigger.mark(market_id)
+            market_done = time.perf_counter()
+            stage_times['market'] += market_done - runners_done
+            self.runner_changes_processed += len(changed_runners)
+            self.market_recomputes += 1
+            market_network, market_apply = latency.market(market_id)
+            market_apply.record((market_done - market_start) * 1000)
+            if network_ms is not None:
+                market_network.record(network_ms)
+
+            if self.tick_writer is not None:
+                for runner_change, runner in zip(market_change.runners, changed_runners):
+                    self.tick_writer.put(self.tick_row(message, market, runner_change, runner, secs_to_start))
+        latency.apply.record((time.perf_counter() - decoded) * 1000)
+
+    def apply_runner_change(self, market, runner_change, timestamp, cleared=False):
+        """Apply one runner delta to the market state and return the changed RunnerState, cleared by an image."""
+        runner = market.runner(runner_change.key, runner_change.id, self.runnerid_name_dict)
+        book = runner.book
+        atb = runner_change.atb
+        atl = runner_change.atl
+        trd = runner_change.trd
+        if atb:
+            book.update_back(atb)
+        if atl:
+            book.update_lay(atl)
+        if atb or atl or cleared:
+            update_book_features(book, runner)
+        volume = runner.traded
+        if cleared:
+            # sizes the image repeats are no new trades
+            volume.replace(trd or (), timestamp)
+        elif trd:
+            volume.update(trd, timestamp)
+        else:
+            volume.expire(timestamp)
+        return self.update_runner(market, runner, timestamp, atb, atl, trd)
+
+    def refresh_runner(self, market, runner, timestamp):
+        """Recompute a runner whose ladders a full image cleared without resending them."""
+        update_book_features(runner.book, runner)
+        runner.traded.replace((), timestamp)
+        return self.update_runner(market, runner, timestamp, True, True, None)
+
+    def remove_runners(self, market, definition):
+        """Take runners the market definition marks REMOVED out of the overround, True if any still counted."""
+        overround = market.overround
+        removed = False
+        for runner in definition.get('runners', ()):
+            if runner.get('status') == 'REMOVED' and overround.remove_runner(str(runner['id'])):
+                removed = True
+        return removed
+
+    def update_runner(self, market, runner, timestamp, atb, atl, trd):
+        """Prices, rolling statistics and volume fields of a runner after its book and volume changed."""
+        book = runner.book
+        volume = runner.traded
+        # Update values and rolling statistics
+        new_back = book.back_price
+        new_lay = book.lay_price
+        new_last = trd[0][0] if trd else runner.last
+        runner.back_history.append(new_back, timestamp)
+        runner.lay_history.append(new_lay, timestamp)
+        runner.last_history.append(new_last, timestamp)
+
+        runner.back = new_back
+        runner.lay = new_lay
+        runner.last = new_last
+        overround = market.overround
+        overround.update('back', runner.runner_id, new_back)
+        overround.update('lay', runner.runner_id, new_lay)
+        overround.update('last', runner.runner_id, new_last)
+        runner.volume = volume.total
+        runner.traded_vwap = volume.vwap or 0.0
+        runner.recent_volume = volume.recent_volume
+
+        runner.delta_back = new_back if atb else None
+        runner.delta_lay = new_lay if atl else None
+        runner.delta_last = new_last if trd else None
+
+        runner.horse_info = self.horse_info_dict.get(runner.name)
+        return runner
+
+    def update_market(self, market, start_epoch, race_start_time):
+        """Recompute the market level fields after all runner deltas were applied."""
+        race_info = self.race_dict[market.market_id]
+        overround = market.overround
+        market.lay_overrun = overround.total('lay')
+        market.back_overrun = overround.total('back')
+        market.last_overrun = overround.total('last')
+        market.race_title = race_info['fullTitle'] + ' (' + race_info['market_type'] + ')'
+        market.start_time = start_epoch
+        market.race_start_time = race_start_time.isoformat()
+
+    def tick_row(self, message, market, runner_change, runner, secs_to_start):
+        """Tick record of one runner change for the tickdata collection."""
+        trd = runner_change.trd
+        book = runner.book
+        return {
+            'meta': {
+                'market_id': market.market_id,
+                'runner_id': runner.runner_id,
+                'runner_name': runner.name,
+                'secs_to_start': -secs_to_start,
+            },
+            # divide by 1000 to convert from milliseconds to seconds
+            'pt': datetime.fromtimestamp(message.pt/1000) if message.pt else None,
+            'back_odds': runner.back or None,
+            'back_vol': book.back_size or None,
+            'lay_odds': runner.lay or None,
+            'lay_vol': book.lay_size or None,
+            'traded_odds': trd[0][0] if trd else None,
+            'traded_vol': trd[0][1] if trd else None,
+            'back_vwap': runner.back_vwap,
+            'lay_vwap': runner.lay_vwap,
+            'cumulative_volume': runner.volume or None,
+            'overrun_back': market.back_overrun or None,
+            'overrun_lay': market.lay_overrun or None,
+            'overrun_last': market.last_overrun or None,
+        }
+
+    def reset_clk(self):
+        """Forget the subscription tokens, the next subscription must be a full one."""
+        self.last_initial_clk = None
+        self.last_clk = None
+
+    @property
+    def market_recomputes_saved(self):
+        """Market recomputes avoided by updating once per market change instead of once per runner."""
+        return self.runner_changes_processed - self.market_recomputes
+
+    def conflation_stats(self):
+        return {'runner_changes': self.runner_changes_processed,
+                'market_recomputes': self.market_recomputes,
+                'market_recomputes_saved': self.market_recomputes_saved}
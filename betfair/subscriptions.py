@@ -0,0 +1,96 @@
+"""Chooses the markets to stream from the time windows of the active strategies."""
+import logging
+import time
+
+from betfair.prefilter import static_filter
+
+log = logging.getLogger(__name__)
+
+SUBSCRIBE_LEAD_SECONDS = 90  # subscribe this long before a window opens, covers the pool update interval and the image
+UNSUBSCRIBE_GRACE_SECONDS = 30
+ACTIVE_STRATEGY_STATES = ('on', 'dummy')  # strategies that can place orders
+
+
+def strategy_window(strategy, race, start_epoch):
+    """
+    (enter, leave) epoch seconds of the time a strategy can bet on a race, None
+    if its country, market type, sport or harness selection exclude the race.
+
+    Uses the same defaults as StrategyHandler.check_execute.
+    """
+    if strategy.get('active', 'off') not in ACTIVE_STRATEGY_STATES:
+        return None
+    if static_filter(strategy, race) is not None:
+        return None
+    # secsToStartSlider bounds are seconds after the start, negative before it
+    window = strategy.get('secsToStartSlider')
+    if not window:
+        return None
+    return start_epoch + float(window[0]), start_epoch + float(window[1])
+
+
+class SubscriptionScheduler:
+    """
+    Streams a market only while some active strategy can bet on it.
+
+    A market is subscribed lead seconds before the first strategy window opens
+    and dropped grace seconds after the last one closed. When more markets are
+    in demand than the stream pool can take, the ones starting first win.
+
+    Windows come from the market clock, which recomputes them only when a
+    market's start time or the strategies change.
+
+    Args:
+        capacity (int): markets the stream pool can subscribe
+        clock (MarketClock): market clock shared with the strategy engine
+        lead (float): seconds to subscribe before a window opens
+        grace (float): seconds to keep a market after the last window closed
+
+    """
+
+    def __init__(self, capacity, clock, lead=SUBSCRIBE_LEAD_SECONDS, grace=UNSUBSCRIBE_GRACE_SECONDS):
+        self.capacity = capacity
+        self.clock = clock
+        self.lead = lead
+        self.grace = grace
+        self.stats = {'candidates': 0, 'waiting': 0, 'in_demand': 0, 'selected': 0, 'over_capacity': 0}
+
+    def plan(self, market_ids, race_dict, strategies, now=None):
+        """
+        Markets to stream now, and the epoch seconds of the next change of that
+        set (None if nothing is scheduled).
+        """
+        if now is None:
+            now = time.time()
+        market_ids = list(market_ids)
+        clock = self.clock
+        clock.update(race_dict, strategies, market_ids, now)
+        clock.prune(market_ids)
+        in_demand = []  # (start epoch, market id)
+        next_change = None
+        waiting = 0
+        for market_id in market_ids:
+            window = clock.window(market_id)
+            if window is None:
+                continue
+            enter, leave = window
+            enter -= self.lead
+            leave += self.grace
+            if now < enter:
+                waiting += 1
+                change = enter
+            elif now <= leave:
+                in_demand.append((clock.start(market_id), market_id))
+                change = leave
+            else:
+                continue
+            next_change = change if next_change is None else min(next_change, change)
+
+        in_demand.sort()
+        selected = {market_id for _, market_id in in_demand[:self.capacity]}
+        over_capacity = len(in_demand) - len(selected)
+        if over_capacity:
+            log.warning(f"{over_capacity} markets in strategy windows exceed the stream capacity of {self.capacity}")
+        self.stats = {'candidates': len(market_ids), 'waiting': waiting, 'in_demand': len(in_demand),
+                      'selected': len(selected), 'over_capacity': over_capacity}
+        return selected, next_change
@@ -0,0 +1,124 @@
+"""Background batched writer for tick data rows."""
+import logging
+import queue
+import threading
+import time
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+log = logging.getLogger(__name__)
+
+TICKDATA_QUEUE_SIZE = 100000
+TICKDATA_BATCH_SIZE = 500
+TICKDATA_FLUSH_SECONDS = 1.
+TICKDATA_FULL_POLICY = 'drop'  # 'drop' new rows or 'block' the stream thread when the queue is full
+TICKDATA_STATS_LOG_SECONDS = 60
+
+
+class TickDataWriter:
+    """
+    Writes tick rows to mongo from a worker thread so the stream thread never waits on the database.
+
+    Rows go into a bounded queue and are written with insert_many(ordered=False)
+    once batch_size rows are collected or flush_interval seconds have passed.
+    One writer is shared by the listeners of all stream connections, put() can
+    be called from any thread.
+
+    Args:
+        collection: pymongo collection to write to
+        queue_size (int): maximum number of rows waiting to be written
+        batch_size (int): rows per insert_many call
+        flush_interval (float): seconds after which a partial batch is written
+        policy (str): 'drop' counts and discards rows when the queue is full,
+                      'block' makes put() wait for free space
+
+    """
+
+    def __init__(self, collection, queue_size=TICKDATA_QUEUE_SIZE, batch_size=TICKDATA_BATCH_SIZE,
+                 flush_interval=TICKDATA_FLUSH_SECONDS, policy=TICKDATA_FULL_POLICY):
+        if policy not in ('drop', 'block'):
+            raise ValueError(f"Unknown tick data queue policy {policy}")
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()  # counters of put(), called by every stream thread
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='TickDataWriter', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Flush what is queued and stop the worker thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def put(self, row):
+        """Queue a row, returns False if it was dropped."""
+        if self.policy == 'block':
+            self._queue.put(row)
+        else:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def stats(self):
+        return {'queued': self.queued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'pending': self._queue.qsize()}
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        next_stats_log = time.monotonic() + TICKDATA_STATS_LOG_SECONDS
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                batch.append(self._queue.get(timeout=max(0., deadline - time.monotonic())))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            if len(batch) >= self.batch_size or now >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = now + self.flush_interval
+            if now >= next_stats_log:
+                log.info(f"Tick data writer: {self.stats()}")
+                next_stats_log = now + TICKDATA_STATS_LOG_SECONDS
+        self._flush(batch)
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            inserted = e.details.get('nInserted', 0)
+            self.written += inserted
+            self.failed += len(batch) - inserted
+            log.warning(f"Tick data batch partially written: {len(batch) - inserted} of {len(batch)} rows failed")
+        except PyMongoError as e:
+            self.failed += len(batch)
+            log.error(f"Tick data batch of {len(batch)} rows failed: {e}")
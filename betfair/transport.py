@@ -0,0 +1,256 @@
+"""Awaitable Betfair REST calls on a pool of keep-alive sessions, off the event loop."""
+import asyncio
+import heapq
+import itertools
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import attrgetter
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from betfair.config import MARKET_TYPES, MAX_RACE_STREAMS, client
+from betfair.session import session_manager
+
+log = logging.getLogger(__name__)
+
+TRANSPORT_THREADS = 12  # one pooled session each, at least the sum of the endpoint limits
+SESSION_POOL_CONNECTIONS = 4  # keep-alive connections per host and session
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT_SECONDS = 10
+# endpoint -> calls in flight at once
+ENDPOINT_CONCURRENCY = {
+    'betting.place_orders': 4,
+    'betting.list_market_catalogue': 2,
+    'betting.list_market_book': 4,
+    'betting.list_cleared_orders': 1,
+    'account.get_account_funds': 1,
+}
+# endpoint -> seconds before the caller stops waiting, None to wait for the answer
+ENDPOINT_TIMEOUTS = {
+    'betting.place_orders': None,  # an abandoned placement can still be executed
+    'betting.list_market_catalogue': 30,
+    'betting.list_cleared_orders': 30,
+}
+
+# request priorities, lower first
+PRIORITY_ORDERS = 0
+PRIORITY_DATA = 1
+PRIORITY_ANALYTICS = 2
+REQUEST_WEIGHT_PER_SECOND = 100  # budget of request weight
+DEFAULT_WEIGHT = 1
+# endpoint -> weight per market of the request, after the exchange's data weights
+ENDPOINT_MARKET_WEIGHTS = {
+    'betting.list_market_book': 5,  # EX_BEST_OFFERS
+    'betting.list_market_catalogue': 1,
+}
+# the catalogue pages of a metadata cycle, weight 1 per market, fit in the bucket next to a second of other requests
+REQUEST_WEIGHT_BURST = (ENDPOINT_MARKET_WEIGHTS['betting.list_market_catalogue'] * MAX_RACE_STREAMS * len(MARKET_TYPES)
+                        + REQUEST_WEIGHT_PER_SECOND)
+
+
+def request_weight(endpoint, kwargs):
+    market_weight = ENDPOINT_MARKET_WEIGHTS.get(endpoint)
+    if market_weight is None:
+        return DEFAULT_WEIGHT
+    markets = kwargs.get('market_ids') or kwargs.get('max_results') or 1
+    return market_weight * (markets if isinstance(markets, int) else len(markets))
+
+
+class RequestBudget:
+    """
+    Token bucket of request weight, granted to waiting requests by priority.
+
+    Requests wait until the bucket holds their weight, the highest priority
+    and then the oldest first. Orders (PRIORITY_ORDERS) never wait, they take
+    their weight even into debt, which later requests pay back. A request
+    heavier than the bucket waits for a full bucket and empties it.
+
+    Args:
+        rate (float): weight per second the bucket refills with
+        burst (float): bucket size, the weight that can be used at once
+
+    """
+
+    def __init__(self, rate=REQUEST_WEIGHT_PER_SECOND, burst=REQUEST_WEIGHT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiting = []  # heap of (priority, sequence, weight, future)
+        self._sequence = itertools.count()
+        self._timer = None
+        self.stats = {'granted': 0, 'waited': 0, 'max_wait_ms': 0., 'weight': 0}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, weight, priority):
+        weight = min(weight, self.burst)
+        self.stats['granted'] += 1
+        self.stats['weight'] += weight
+        self._refill()
+        if priority == PRIORITY_ORDERS or (not self._waiting and self.tokens >= weight):
+            self.tokens -= weight
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), weight, future))
+        self.stats['waited'] += 1
+        started = time.perf_counter()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.tokens += weight  # granted but not used
+            else:
+                self._waiting = [waiter for waiter in self._waiting if waiter[3] is not future]
+                heapq.heapify(self._waiting)
+            raise
+        self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], (time.perf_counter() - started) * 1000)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiting and self.tokens >= self._waiting[0][2]:
+            _, _, weight, future = heapq.heappop(self._waiting)
+            if future.done():
+                continue
+            self.tokens -= weight
+            future.set_result(None)
+        if self._waiting and self._timer is None:
+            delay = (self._waiting[0][2] - self.tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+
+def pooled_session(connections=SESSION_POOL_CONNECTIONS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class BetfairTransport:
+    """
+    Runs betfairlightweight endpoint methods on worker threads, each call with
+    a session from a pool of keep-alive sessions.
+
+    request('betting.list_market_book', market_ids=[...]) returns what
+    client.betting.list_market_book(market_ids=[...]) returns, parsed
+    resources included, without blocking the event loop.
+
+    - identical requests made while one is in flight share its call, a
+      cancelled caller stops waiting without cancelling the call of the others
+    - calls per endpoint are limited by a semaphore
+    - the request weight budget lets calls through by priority, orders first
+    - the caller stops waiting after the endpoint's timeout
+      (asyncio.TimeoutError), the thread finishes the request within the
+      client's own connect and read timeouts
+    - a call rejected for its session is retried once after the session
+      manager renewed it
+
+    Args:
+        api_client (APIClient): logged in betfairlightweight client
+        session_manager (SessionManager): session manager of api_client
+        threads (int): worker threads and pooled sessions
+        concurrency (dict): endpoint -> calls in flight at once
+        timeouts (dict): endpoint -> seconds to wait for a call
+        budget (RequestBudget): request weight budget shared by all endpoints
+
+    """
+
+    def __init__(self, api_client, session_manager, threads=TRANSPORT_THREADS, concurrency=None, timeouts=None,
+                 budget=None):
+        self.client = api_client
+        self.session_manager = session_manager
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='betfair-rest')
+        self.sessions = queue.SimpleQueue()
+        for _ in range(threads):
+            self.sessions.put(pooled_session())
+        self.concurrency = dict(ENDPOINT_CONCURRENCY if concurrency is None else concurrency)
+        self.timeouts = dict(ENDPOINT_TIMEOUTS if timeouts is None else timeouts)
+        self.budget = budget or RequestBudget()
+        self._semaphores = {}
+        self._in_flight = {}  # request key -> task of the call all identical requests wait for
+        self.stats = {}  # endpoint -> counters and call times
+
+    async def request(self, endpoint, *args, priority=PRIORITY_DATA, **kwargs):
+        """Call a client endpoint method by its path, e.g. 'account.get_account_funds'."""
+        method = attrgetter(endpoint)(self.client)
+        key = (endpoint, repr(args), repr(sorted(kwargs.items())))
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(
+                self._run(endpoint, method, args, kwargs, priority, request_weight(endpoint, kwargs), True))
+            task.add_done_callback(partial(self._request_done, key))
+        else:
+            self._endpoint_stats(endpoint)['coalesced'] += 1
+        return await asyncio.shield(task)
+
+    def _request_done(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, callers still waiting get it from await
+
+    async def call(self, endpoint, function, *args, priority=PRIORITY_DATA, weight=DEFAULT_WEIGHT, **kwargs):
+        """function(*args, **kwargs) under the limits of endpoint, for wrappers of client methods."""
+        return await self._run(endpoint, function, args, kwargs, priority, weight, False)
+
+    def _endpoint_stats(self, endpoint):
+        stats = self.stats.get(endpoint)
+        if stats is None:
+            stats = self.stats[endpoint] = {'calls': 0, 'coalesced': 0, 'errors': 0, 'timeouts': 0, 'in_flight': 0,
+                                            'last_ms': None, 'max_ms': 0., 'max_wait_ms': 0.}
+        return stats
+
+    async def _run(self, endpoint, function, args, kwargs, priority, weight, pass_session):
+        semaphore = self._semaphores.get(endpoint)
+        if semaphore is None:
+            semaphore = self._semaphores[endpoint] = asyncio.Semaphore(
+                self.concurrency.get(endpoint, DEFAULT_CONCURRENCY))
+        stats = self._endpoint_stats(endpoint)
+        loop = asyncio.get_running_loop()
+        queued = time.perf_counter()
+        async with semaphore:
+            await self.budget.acquire(weight, priority)
+            started = time.perf_counter()
+            stats['max_wait_ms'] = max(stats['max_wait_ms'], (started - queued) * 1000)
+            stats['calls'] += 1
+            stats['in_flight'] += 1
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self.executor, self._call, function, args, kwargs, pass_session),
+                    self.timeouts.get(endpoint, DEFAULT_TIMEOUT_SECONDS))
+            except asyncio.TimeoutError:
+                stats['timeouts'] += 1
+                log.warning(f"{endpoint} timed out")
+                raise
+            except Exception:
+                stats['errors'] += 1
+                raise
+            finally:
+                stats['in_flight'] -= 1
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                stats['last_ms'] = elapsed_ms
+                stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    def _call(self, function, args, kwargs, pass_session):
+        if not pass_session:
+            return self.session_manager.call(function, *args, **kwargs)
+        session = self.sessions.get()
+        try:
+            return self.session_manager.call(function, *args, session=session, **kwargs)
+        finally:
+            self.sessions.put(session)
+
+
+betfair_rest = BetfairTransport(client, session_manager)
@@ -0,0 +1,133 @@
+"""Wakes the strategy engine for markets that changed instead of polling every market."""
+import asyncio
+import threading
+import time
+
+STRATEGY_MAX_WAIT_SECONDS = 1.  # evaluate every market at least this often
+STRATEGY_MIN_INTERVAL_SECONDS = .01  # shortest time between two passes, marks in between are collected
+
+
+class MarketTrigger:
+    """
+    Markets the strategy engine has to evaluate.
+
+    Stream threads mark a market dirty when they publish a new snapshot of it,
+    markets a strategy window opens or closes on are dirty when the market
+    clock's event is due. wait() returns as soon as a market is dirty, or
+    after max_wait with a pass over all markets, which also catches what is
+    neither a price nor a window change (metadata, orders placed elsewhere).
+
+    mark() can be called from any thread, the waiting coroutine is woken with
+    loop.call_soon_threadsafe, at most one wake up is queued at a time.
+
+    wait() always suspends, at least until min_interval passed since it last
+    returned, so markets marked during a pass neither keep the event loop
+    from running other tasks nor trigger a pass each.
+
+    Args:
+        clock (MarketClock): market clock of the strategy window events
+        max_wait (float): longest time in seconds between two passes over all markets
+        min_interval (float): shortest time in seconds between two passes
+
+    """
+
+    def __init__(self, clock, max_wait=STRATEGY_MAX_WAIT_SECONDS, min_interval=STRATEGY_MIN_INTERVAL_SECONDS):
+        self.clock = clock
+        clock.on_timer = self._timer_added
+        self.max_wait = max_wait
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._all = True
+        self._dirty_since = None
+        self._loop = None
+        self._event = None
+        self._wake_queued = False
+        self._last_full = 0.
+        self._last_pass = None  # perf counter of the last return of wait()
+        self._deadline = None  # epoch seconds the waiting coroutine wakes up at without marks
+        self.stats = {'wakeups': 0, 'full_passes': 0, 'markets_evaluated': 0, 'last_reaction_ms': None,
+                      'max_reaction_ms': 0.}
+
+    def mark(self, market_id):
+        with self._lock:
+            self._dirty.add(market_id)
+            if self._dirty_since is None:
+                self._dirty_since = time.perf_counter()
+            wake = self._queue_wake()
+        if wake:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def mark_all(self):
+        """Evaluate every market on the next wake up, e.g. after the strategies changed."""
+        with self._lock:
+            self._all = True
+            wake = self._queue_wake()
+        if wake:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def _timer_added(self, when):
+        with self._lock:
+            # the waiting coroutine sleeps past the new timer, have it recompute its timeout
+            wake = self._deadline is not None and when < self._deadline and self._queue_wake()
+        if wake:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def _queue_wake(self):
+        """True if the caller has to set the event, called with the lock held."""
+        if self._wake_queued or self._loop is None:
+            return False
+        self._wake_queued = True
+        return True
+
+    async def wait(self):
+        """
+        Market ids to evaluate once some are dirty, None to evaluate every
+        market when max_wait passed without a full pass or mark_all was called.
+        """
+        if self._event is None:
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+        # yield to the other tasks even if markets are dirty already
+        delay = 0. if self._last_pass is None else self.min_interval - (time.perf_counter() - self._last_pass)
+        await asyncio.sleep(max(delay, 0.))
+        while True:
+            now = time.time()
+            events = self.clock.due(now)
+            with self._lock:
+                for market_id, _, _ in events:
+                    self._dirty.add(market_id)
+                full = self._all or now - self._last_full >= self.max_wait
+                if full or self._dirty:
+                    dirty, self._dirty = self._dirty, set()
+                    dirty_since, self._dirty_since = self._dirty_since, None
+                    self._all = False
+                    self._wake_queued = False
+                    self._deadline = None
+                    break
+                # a wake up queued by an earlier mark may have set it after it was consumed
+                self._event.clear()
+                timeout = self._last_full + self.max_wait - now
+                next_event = self.clock.next_event()
+                if next_event is not None:
+                    timeout = min(timeout, next_event - now)
+                self._deadline = now + timeout
+                self._wake_queued = False
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        self._last_pass = time.perf_counter()
+        stats = self.stats
+        stats['wakeups'] += 1
+        if dirty_since is not None:
+            reaction_ms = (time.perf_counter() - dirty_since) * 1000
+            stats['last_reaction_ms'] = reaction_ms
+            stats['max_reaction_ms'] = max(stats['max_reaction_ms'], reaction_ms)
+        if full:
+            self._last_full = now
+            stats['full_passes'] += 1
+            return None
+        stats['markets_evaluated'] += len(dirty)
+        return dirty
@@ -0,0 +1,93 @@
+"""Traded volume at price per runner, built from streamed trd deltas."""
+from array import array
+from collections import deque
+
+from betfair.orderbook import NUM_TICKS, TICK_PRICES, price_to_tick
+
+RECENT_VOLUME_SECONDS = 60
+
+
+class TradedVolume:
+    """
+    Cumulative matched size per ladder tick of one runner.
+
+    trd deltas carry the new cumulative size traded at a price, so each update
+    adjusts the total matched and the traded value by the difference. Increases
+    are also kept with their timestamp to give the volume of the last
+    recent_seconds without rescanning the ladder. A full image replaces the
+    sizes, only what it adds to the sizes known before counts as recent.
+
+    """
+
+    __slots__ = ('sizes', 'total', 'total_value', 'recent_seconds', 'recent_volume', '_recent')
+
+    def __init__(self, recent_seconds=RECENT_VOLUME_SECONDS):
+        self.sizes = array('d', bytes(8 * NUM_TICKS))
+        self.total = 0.
+        self.total_value = 0.
+        self.recent_seconds = recent_seconds
+        self.recent_volume = 0.
+        self._recent = deque()  # (timestamp, size increase)
+
+    def clear(self):
+        self.sizes = array('d', bytes(8 * NUM_TICKS))
+        self.total = 0.
+        self.total_value = 0.
+        self.recent_volume = 0.
+        self._recent.clear()
+
+    def update(self, levels, timestamp):
+        """Apply trd deltas received at timestamp (seconds)."""
+        sizes = self.sizes
+        increase = 0.
+        for price, size in levels:
+            i = price_to_tick(price)
+            change = size - sizes[i]
+            sizes[i] = size
+            self.total += change
+            self.total_value += change * TICK_PRICES[i]
+            if change > 0:
+                increase += change
+        if increase:
+            self._recent.append((timestamp, increase))
+            self.recent_volume += increase
+        self.expire(timestamp)
+
+    def replace(self, levels, timestamp):
+        """Apply the trd levels of a full image, prices it leaves out have no traded size."""
+        previous = self.sizes
+        sizes = self.sizes = array('d', bytes(8 * NUM_TICKS))
+        ticks = set()
+        for price, size in levels:
+            i = price_to_tick(price)
+            sizes[i] = size
+            ticks.add(i)
+        total = total_value = increase = 0.
+        for i in ticks:
+            size = sizes[i]
+            total += size
+            total_value += size * TICK_PRICES[i]
+            if size > previous[i]:
+                increase += size - previous[i]
+        self.total = total
+        self.total_value = total_value
+        if increase:
+            self._recent.append((timestamp, increase))
+            self.recent_volume += increase
+        self.expire(timestamp)
+
+    def expire(self, now):
+        """Drop increases older than recent_seconds from the recent volume."""
+        cutoff = now - self.recent_seconds
+        recent = self._recent
+        while recent and recent[0][0] < cutoff:
+            self.recent_volume -= recent.popleft()[1]
+        if not recent:
+            self.recent_volume = 0.  # no float residue once the window is empty
+
+    @property
+    def vwap(self):
+        return self.total_value / self.total if self.total > 0 else None
+
+    def size_at(self, price):
+        return self.sizes[price_to_tick(price)]
@@ -0,0 +1,42 @@
+"""
+betfair.config connects to Mongo and reads the Betfair login when it is
+imported. Tests import the package against an offline module with the same
+names and no database behind the collections.
+"""
+import socket
+import sys
+import types
+
+import betfairlightweight
+
+COLLECTIONS = ('metadata_collection', 'punters_com_au_collection', 'tickdata_collection', 'orders_collection',
+               'strategy_collection', 'admin_collection', 'winner_collection')
+
+
+def offline_config():
+    config = types.ModuleType('betfair.config')
+    config.USERNAME = 'test'
+    config.HOSTNAME = '127.0.0.1'
+    config.MONGO_USERNAME = 'test'
+    config.MONGO_PASSWROD = 'test'
+    config.MONGO_DB = 'horse_racing'
+    config.MONGO_AUTH_DB = 'admin'
+    config.COUNTRIES = ['UK', 'US', 'AU', 'IE']
+    config.MARKET_TYPES = ['WIN', 'PLACE']
+    config.MAX_RACE_STREAMS = 200
+    config.EVENT_TYPE_IDS = ['7', '4339']
+    config.KEEP_AFTER_RACE_START_MIN = 15
+    config.HOURS_TO_FETCH = 8
+    config.MARKET_FETCH_MINUTES = 2
+    config.SECS_MARKET_FETCH_INTERVAL = config.MARKET_FETCH_MINUTES * 60
+    config.SERVER_NAMES = []
+    for name in COLLECTIONS:
+        setattr(config, name, None)
+    config.client = betfairlightweight.APIClient('test', 'test', app_key='test')
+    config.upsert_event_metadata = lambda race_data: None
+    config.is_prod_computer = lambda: False
+    config.computer_name = socket.gethostname
+    return config
+
+
+sys.modules['betfair.config'] = offline_config()
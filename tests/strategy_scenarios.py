@@ -0,0 +1,99 @@
+"""
+Seeded random markets, stream updates and strategies for the strategy engine tests.
+
+Times are offsets in seconds from the start of a run, so a scenario evaluates
+the same whenever it is run. Nothing here imports the betfair package.
+"""
+import random
+
+COUNTRIES = ['AU', 'GB', 'US', 'IE']
+PRICES = [1.5, 2.0, 3.5, 5.0, 8.0, 12.0, 25.0, 50.0]
+CONDITIONS = ['W%', 'Avg $', 'Rtg', 'Age', 'Current lay price', 'Last total odds', 'Horses per race', 'Traded volume',
+              'Weight of money', 'Spread ticks', 'Microprice', 'Depth imbalance', 'Lay VWAP', 'Unknown']
+
+
+def build_scenario(seed, markets=12, strategies=10):
+    """
+    Dict of races (market id -> race metadata with 'start_offset' instead of
+    'start_time'), runnerid_name, horse_info, strategies and steps, a list of
+    market changes per step. The engine is run after every step.
+    """
+    rng = random.Random(seed)
+    races = {}
+    runnerid_name = {}
+    horse_info = {}
+    for m in range(markets):
+        market_id = f'1.{300 + m}'
+        runners = [{'selectionId': 1000 * m + r, 'runnerName': f'{r + 1}. Horse{m}_{r}'}
+                   for r in range(rng.randint(4, 14))]
+        for runner in runners:
+            runnerid_name[runner['selectionId']] = runner['runnerName']
+            if rng.random() < .8:
+                horse_name = runner['runnerName'].split('. ')[1]
+                horse_info[horse_name] = {'Horse Name': horse_name,
+                                          'W%': f"{rng.randint(0, 60)}%",
+                                          'Avg $': f"${rng.randint(100, 9000)}",
+                                          'Rtg': str(rng.randint(40, 100)) if rng.random() < .9 else 'N/A',
+                                          'Age': rng.choice([2, 3, 4, 5, 6.5, None, 'x'])}
+        races[market_id] = {'start_offset': rng.choice([-200, 30, 120, 600, 3000]),
+                            'runners': runners,
+                            'event': {'countryCode': rng.choice(COUNTRIES), 'venue': 'V'},
+                            'fullTitle': 'Horse Racing R1 ' + rng.choice(['Trot', 'Flat', 'Pace', 'Hurdle']) + ' V',
+                            'marketName': 'R1',
+                            'market_type': rng.choice(['WIN', 'PLACE']),
+                            'event_type': {'name': rng.choice(['Horse Racing', 'Horse Racing', 'Greyhound Racing'])},
+                            'totalMatched': 1000}
+
+    opening = []
+    for market_id, race in races.items():
+        runner_changes = []
+        for runner in race['runners']:
+            price = rng.choice(PRICES)
+            runner_change = {'id': runner['selectionId'], 'atb': [[price, 20]],
+                             'atl': [[round(price * 1.1, 1) if price < 4 else price + 1, 15]], 'trd': [[price, 100]]}
+            if rng.random() < .2:
+                del runner_change['atl']
+            if rng.random() < .1:
+                del runner_change['trd']
+            runner_changes.append(runner_change)
+        opening.append({'id': market_id, 'rc': runner_changes})
+
+    def tick():
+        changes = []
+        for market_id, race in races.items():
+            runner_changes = []
+            for runner in rng.sample(race['runners'], max(1, len(race['runners']) // 3)):
+                price = rng.choice(PRICES)
+                runner_changes.append({'id': runner['selectionId'], 'atb': [[price, rng.randint(1, 50)]],
+                                       'trd': [[price, rng.randint(100, 500)]]})
+            changes.append({'id': market_id, 'rc': runner_changes})
+        return changes
+
+    strategy_dicts = {}
+    for i in range(strategies):
+        strategy = {'StrategyName': f'S{i}', 'betSize': 2, 'betType': rng.choice(['Lay', 'Back']),
+                    'maxHorsesToBet': rng.randint(1, 5),
+                    'maxHorsesToBetStrategy': rng.choice(['highest odds first', 'lowest odds first']),
+                    'priceStrategy': rng.choice(['last', 'back', 'lay', '_back_moving_avg', 'wom', 'nope']),
+                    'active': 'dummy' if i < strategies // 2 else rng.choice(['dummy', 'off']),
+                    'priceMaxValue': 30, 'priceMinValue': 1.5, 'market_type': rng.choice(['WIN', 'PLACE']),
+                    'harnessSelection': rng.choice(['any', 'Harness only', 'Non harness only']),
+                    'selectedSportType': 'Horse Racing',
+                    'selectedCountries': rng.sample(COUNTRIES, 3),
+                    'secsToStartSlider': [rng.choice([-4000, -700, -100]), rng.choice([0, 300, 4000])],
+                    'missingConditionsData': rng.choice(['risk', 'skip'])}
+        for condition in rng.sample(CONDITIONS, rng.randint(0, 4)):
+            low = rng.choice([0, 1, 2, 5, 20, 0.3])
+            strategy[condition] = {'min': low, 'max': low + rng.choice([3, 10, 50, 1000, 0.4])}
+            if rng.random() < .05:
+                strategy[condition] = {'min': 'abc', 'max': 3}
+        strategy_dicts[strategy['StrategyName']] = strategy
+
+    return {'races': races, 'runnerid_name': runnerid_name, 'horse_info': horse_info, 'strategies': strategy_dicts,
+            'steps': [opening, tick(), tick() + tick()]}
+
+
+def order_key(order):
+    """Order fields that do not depend on when the scenario ran."""
+    return {key: round(value) if key == 'seconds_to_start' else value
+            for key, value in order.items() if key not in ('timestamp', 'host')}
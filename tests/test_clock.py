@@ -0,0 +1,79 @@
+"""TimerWheel against a sorted list of timers, and MarketClock window events."""
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from betfair.clock import ENTER, LEAVE, WINDOW_BOUNDARY_DELAY, MarketClock, TimerWheel
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_wheel_matches_brute_force(seed):
+    rng = random.Random(seed)
+    now = 1700000000.
+    wheel = TimerWheel(tick=.1, slots=rng.choice([8, 64, 1024]), now=now)
+    pending = []
+    for i in range(400):
+        for _ in range(rng.randint(0, 3)):
+            # within the rotation, beyond it and in the past
+            when = now + rng.choice([rng.uniform(0, 2), rng.uniform(0, 300), rng.uniform(-5, 0)])
+            wheel.add(when, i)
+            pending.append((when, i))
+        assert wheel.next_due() == (min(when for when, _ in pending) if pending else None)
+        now += rng.choice([0., .05, .3, 2., 150.])
+        due = sorted(timer for timer in pending if timer[0] <= now)
+        pending = [timer for timer in pending if timer[0] > now]
+        fired = wheel.advance(now)
+        assert sorted(fired) == sorted(item for _, item in due)
+        assert wheel.count == len(pending)
+
+
+def test_wheel_never_fires_early():
+    wheel = TimerWheel(tick=1., slots=4, now=0.)
+    wheel.add(10.5, 'late')
+    assert wheel.advance(10.4) == []
+    assert wheel.advance(10.5) == ['late']
+
+
+def race(start, country='AU'):
+    return {'start_time': datetime.fromtimestamp(start, timezone.utc), 'event_type': {'name': 'Horse Racing'},
+            'market_type': 'WIN', 'fullTitle': 'R1 Flat', 'event': {'countryCode': country}}
+
+
+STRATEGIES = {'s': {'active': 'on', 'selectedCountries': ['AU'], 'secsToStartSlider': [-60, 10]}}
+
+
+def test_window_events():
+    now = 1000.
+    clock = MarketClock(now=now)
+    added = []
+    clock.on_timer = added.append
+    races = {'1.1': race(now + 100), '1.2': race(now + 100, country='GB')}
+    clock.update(races, STRATEGIES, ['1.1', '1.2'], now=now)
+
+    assert clock.window('1.1') == (now + 40, now + 110)
+    assert clock.window('1.2') is None  # the strategy excludes GB
+    assert clock.seconds_to_start('1.1', now=now) == 100
+    assert clock.next_event() == now + 40
+    assert added == [now + 40, now + 110 + WINDOW_BOUNDARY_DELAY]
+    assert clock.due(now + 39) == []
+    assert clock.due(now + 40) == [('1.1', 's', ENTER)]
+    assert clock.due(now + 110 + WINDOW_BOUNDARY_DELAY) == [('1.1', 's', LEAVE)]
+
+
+def test_moved_start_drops_old_timers():
+    now = 1000.
+    clock = MarketClock(now=now)
+    clock.update({'1.1': race(now + 100)}, STRATEGIES, ['1.1'], now=now)
+    clock.update({'1.1': race(now + 200)}, STRATEGIES, ['1.1'], now=now)
+    assert clock.due(now + 50) == []  # enter of the old start time
+    assert clock.due(now + 140) == [('1.1', 's', ENTER)]
+
+
+def test_prune_forgets_market():
+    now = 1000.
+    clock = MarketClock(now=now)
+    clock.update({'1.1': race(now + 100)}, STRATEGIES, ['1.1'], now=now)
+    clock.prune(set())
+    assert clock.start('1.1') is None
+    assert clock.due(now + 200) == []
@@ -0,0 +1,116 @@
+"""ExecutionService batching, result mapping and failures, through a transport with a fake client."""
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from betfair.execution import MAX_INSTRUCTIONS_PER_CALL, ExecutionService
+from betfair.session import SessionManager
+from betfair.transport import BetfairTransport
+
+
+class Client:
+    session_token = 'token'
+    session_expired = False
+
+
+class Exchange:
+    """place_orders stand-in recording its calls."""
+
+    def __init__(self, fail_markets=(), drop_reports=False):
+        self.calls = []
+        self.fail_markets = fail_markets
+        self.drop_reports = drop_reports
+        self.lock = threading.Lock()
+
+    def place(self, market_id, instructions):
+        with self.lock:
+            self.calls.append((market_id, len(instructions)))
+        if market_id in self.fail_markets:
+            raise RuntimeError('exchange down')
+        if self.drop_reports:
+            return 'FAILURE', []
+        return 'SUCCESS', [SimpleNamespace(status='SUCCESS', bet_id=f"{market_id}-{instruction['selectionId']}",
+                                           average_price_matched=instruction['limitOrder']['price'])
+                           for instruction in instructions]
+
+
+def service(exchange):
+    client = Client()
+    return ExecutionService(place=exchange.place, transport=BetfairTransport(client, SessionManager(client), threads=2))
+
+
+def test_intents_are_batched_per_market():
+    exchange = Exchange()
+
+    async def main():
+        execution = service(exchange)
+        futures = [execution.submit(market_id, selection_id, 2, 3.5)
+                   for market_id in ('1.1', '1.2') for selection_id in range(3)]
+        return await asyncio.gather(*futures), execution.stats
+
+    results, stats = asyncio.run(main())
+    assert sorted(exchange.calls) == [('1.1', 3), ('1.2', 3)]
+    assert results[0] == ('SUCCESS', '1.1-0', 3.5)
+    assert results[5] == ('SUCCESS', '1.2-2', 3.5)
+    assert stats['calls'] == 2
+    assert stats['max_batch'] == 3
+
+
+def test_batches_respect_the_instruction_limit():
+    exchange = Exchange()
+
+    async def main():
+        execution = service(exchange)
+        return await asyncio.gather(*[execution.submit('1.1', selection_id, 2, 2.0)
+                                      for selection_id in range(MAX_INSTRUCTIONS_PER_CALL + 1)])
+
+    results = asyncio.run(main())
+    assert sorted(exchange.calls) == [('1.1', 1), ('1.1', MAX_INSTRUCTIONS_PER_CALL)]
+    assert len({bet_id for _, bet_id, _ in results}) == MAX_INSTRUCTIONS_PER_CALL + 1
+
+
+def test_failed_call_fails_its_intents_only():
+    exchange = Exchange(fail_markets={'1.2'})
+
+    async def main():
+        execution = service(exchange)
+        ok = execution.submit('1.1', 1, 2, 2.0)
+        failed = [execution.submit('1.2', selection_id, 2, 2.0) for selection_id in range(2)]
+        results = await asyncio.gather(ok, *failed, return_exceptions=True)
+        return results, execution.stats
+
+    results, stats = asyncio.run(main())
+    assert results[0] == ('SUCCESS', '1.1-1', 2.0)
+    assert all(isinstance(result, RuntimeError) for result in results[1:])
+    assert stats['failed_calls'] == 1
+
+
+def test_bad_instruction_fails_every_intent_of_its_batch():
+    exchange = Exchange()
+
+    async def main():
+        execution = service(exchange)
+        futures = [execution.submit('1.1', 1, 2, 2.0), execution.submit('1.1', 2, 2, 'N/A')]
+        return await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), 5), execution.stats
+
+    results, stats = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert exchange.calls == []
+    assert stats['failed_calls'] == 1
+
+
+def test_missing_reports_give_the_call_status():
+    exchange = Exchange(drop_reports=True)
+
+    async def main():
+        execution = service(exchange)
+        return await execution.submit('1.1', 1, 2, 2.0)
+
+    assert asyncio.run(main()) == ('FAILURE', None, None)
+
+
+def test_submit_needs_a_running_loop():
+    with pytest.raises(RuntimeError):
+        service(Exchange()).submit('1.1', 1, 2, 2.0)
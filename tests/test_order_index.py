@@ -0,0 +1,72 @@
+"""OrderIndex counts and the order index StrategyHandler loads at startup."""
+import asyncio
+
+from betfair import strategy
+from betfair.order_index import OrderIndex
+
+
+def order(market_id, selection_id, strategy_name='S1', user='default'):
+    return {'market_id': market_id, 'selection_id': selection_id, 'strategy_name': strategy_name, 'user': user}
+
+
+def test_counts_per_market_user_and_strategy():
+    index = OrderIndex()
+    index.record(order('1.1', 10))
+    index.record(order('1.1', 11))
+    index.record(order('1.1', 12, strategy_name='S2'))
+    index.record(order('1.1', 13, user='other'))
+    index.record(order('1.2', 10))
+    assert index.count('1.1', 'default', 'S1') == 2
+    assert index.count('1.1', 'default', 'S2') == 1
+    assert index.count('1.1', 'other', 'S1') == 1
+    assert index.count('1.3', 'default', 'S1') == 0
+    assert index.orders == 5
+
+
+def test_selections_match_as_strings():
+    index = OrderIndex()
+    index.record(order('1.1', 10))
+    assert index.has_order('1.1', 10)
+    assert index.has_order('1.1', '10')
+    assert not index.has_order('1.1', 11)
+    assert not index.has_order('1.2', 10)
+
+
+def test_orders_without_user_count_as_default():
+    index = OrderIndex()
+    index.record({'market_id': '1.1', 'selection_id': 10, 'strategy_name': 'S1'})
+    assert index.count('1.1', 'default', 'S1') == 1
+
+
+def test_load_skips_incomplete_orders():
+    index = OrderIndex()
+    index.load([order('1.1', 10), {'market_id': '1.1'}, {'selection_id': 3}])
+    assert index.orders == 1
+
+
+def test_forget_drops_a_market():
+    index = OrderIndex()
+    index.load([order('1.1', 10), order('1.1', 11, strategy_name='S2'), order('1.2', 10)])
+    index.forget('1.1')
+    index.forget('1.9')
+    assert index.count('1.1', 'default', 'S1') == 0
+    assert not index.has_order('1.1', 10)
+    assert index.count('1.2', 'default', 'S1') == 1
+    assert index.orders == 1
+
+
+def test_handler_loads_the_orders_of_this_computer(monkeypatch):
+    requests = []
+
+    async def get_recent_orders(hours, host):
+        requests.append((hours, host))
+        return [order('1.1', 10)]
+
+    monkeypatch.setattr(strategy, 'get_recent_orders', get_recent_orders)
+    monkeypatch.setattr(strategy, 'computer_name', lambda: 'host-a')
+    handler = strategy.StrategyHandler()
+    execution = handler.execution
+    asyncio.run(handler.load_orders(hours=6))
+    assert requests == [(6, 'host-a')]
+    assert handler.order_index.has_order('1.1', 10)
+    assert handler.execution is execution
@@ -0,0 +1,82 @@
+"""RunnerBook against a dict ladder of price -> size, and full images in the listener."""
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from betfair.orderbook import NUM_TICKS, TICK_PRICES, RunnerBook, price_to_tick
+from betfair.snapshot import SnapshotStore
+from betfair.streamer import HorseRaceListener
+
+
+def reference_levels(ladder, side, n):
+    prices = sorted((price for price, size in ladder.items() if size > 0), reverse=side == 'back')
+    return [(price, ladder[price]) for price in prices[:n]]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_dict_ladder(seed):
+    rng = random.Random(seed)
+    prices = rng.sample(TICK_PRICES, 30)
+    book = RunnerBook()
+    ladders = {'back': {}, 'lay': {}}
+    for _ in range(300):
+        side = rng.choice(['back', 'lay'])
+        levels = [[price, rng.choice([0, 0, rng.randint(1, 500)])] for price in rng.sample(prices, rng.randint(1, 4))]
+        (book.update_back if side == 'back' else book.update_lay)(levels)
+        ladders[side].update((price, size) for price, size in levels)
+
+        for name, ladder in ladders.items():
+            expected = reference_levels(ladder, name, 3)
+            assert book.best_levels(name, 3) == expected
+            best_price, best_size = expected[0] if expected else (0., 0.)
+            assert getattr(book, f'{name}_price') == best_price
+            assert getattr(book, f'{name}_size') == best_size
+            if expected:
+                total = sum(size for _, size in expected)
+                assert book.vwap(name) == pytest.approx(sum(price * size for price, size in expected) / total)
+            else:
+                assert book.vwap(name) is None
+        price = rng.choice(prices)
+        assert book.size_at('back', price) == ladders['back'].get(price, 0)
+
+
+def test_price_to_tick_rounds_to_nearest_tick():
+    assert price_to_tick(1.01) == 0
+    assert price_to_tick(1000) == NUM_TICKS - 1
+    assert price_to_tick(1.0) == 0
+    assert price_to_tick(2000) == NUM_TICKS - 1
+    assert TICK_PRICES[price_to_tick(2.009)] == 2.0
+    assert TICK_PRICES[price_to_tick(2.011)] == 2.02
+
+
+def test_clear_empties_both_sides():
+    book = RunnerBook()
+    book.update_back([[2.0, 10]])
+    book.update_lay([[2.1, 5]])
+    book.clear()
+    assert (book.back_price, book.lay_price) == (0., 0.)
+    assert book.best_levels('back') == book.best_levels('lay') == []
+
+
+def image(runners, pt):
+    return json.dumps({'op': 'mcm', 'pt': pt, 'mc': [{'id': '1.1', 'img': True, 'rc': runners}]})
+
+
+def test_image_clears_runners_it_leaves_out():
+    race_dict = {'1.1': {'start_time': datetime.now(pytz.utc) + timedelta(minutes=5),
+                         'fullTitle': 'Race 1', 'market_type': 'WIN'}}
+    snapshots = SnapshotStore()
+    listener = HorseRaceListener({}, frozenset({'1.1'}), race_dict, {}, {}, {1: '1. Alpha', 2: '2. Beta'}, snapshots)
+    alpha = {'id': 1, 'atb': [[2.0, 10]], 'atl': [[2.1, 5]]}
+    beta = {'id': 2, 'atb': [[3.0, 10]], 'atl': [[3.2, 5]], 'trd': [[3.0, 4]]}
+    listener.on_data(image([alpha, beta], 1700000000000))
+    assert snapshots.get('1.1').runners['2']['back'] == 3.
+
+    listener.on_data(image([alpha], 1700000001000))
+    runners = snapshots.get('1.1').runners
+    assert (runners['1']['back'], runners['1']['lay']) == (2., 2.1)
+    assert (runners['2']['back'], runners['2']['lay'], runners['2']['volume']) == (0., 0., 0.)
+    assert runners['2']['wom'] is None
@@ -0,0 +1,42 @@
+"""MarketOverround sums and runners removed by the market definition."""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from betfair.overround import MarketOverround
+from betfair.snapshot import SnapshotStore
+from betfair.streamer import HorseRaceListener
+
+
+def test_remove_runner():
+    overround = MarketOverround()
+    overround.update('back', '1', 2.)
+    overround.update('back', '2', 4.)
+    assert overround.total('back') == pytest.approx(.75)
+    assert overround.remove_runner('2')
+    assert overround.total('back') == pytest.approx(.5)
+    assert not overround.remove_runner('2')
+    assert overround.total('back') == pytest.approx(.5)
+
+
+def test_removed_runner_leaves_the_market_overround():
+    now = datetime.now(pytz.utc)
+    race_dict = {'1.1': {'start_time': now + timedelta(minutes=5), 'fullTitle': 'Race 1', 'market_type': 'WIN'}}
+    snapshots = SnapshotStore()
+    listener = HorseRaceListener({}, frozenset({'1.1'}), race_dict, {}, {}, {1: '1. Alpha', 2: '2. Beta'}, snapshots)
+    published = int(now.timestamp() * 1000)
+    listener.on_data(json.dumps({'op': 'mcm', 'pt': published, 'mc': [
+        {'id': '1.1', 'img': True, 'rc': [{'id': 1, 'atb': [[2.0, 10]]}, {'id': 2, 'atb': [[4.0, 10]]}]}]}))
+    assert snapshots.get('1.1').market['_back_overrun'] == pytest.approx(.75)
+
+    definition = {'runners': [{'id': 1, 'status': 'ACTIVE'}, {'id': 2, 'status': 'REMOVED'}]}
+    listener.on_data(json.dumps({'op': 'mcm', 'pt': published + 1000,
+                                 'mc': [{'id': '1.1', 'marketDefinition': definition}]}))
+    assert snapshots.get('1.1').market['_back_overrun'] == pytest.approx(.5)
+    version = snapshots.get('1.1').version
+    # definitions are resent with every change, a runner already taken out publishes nothing
+    listener.on_data(json.dumps({'op': 'mcm', 'pt': published + 2000,
+                                 'mc': [{'id': '1.1', 'marketDefinition': definition}]}))
+    assert snapshots.get('1.1').version == version
@@ -0,0 +1,74 @@
+"""StreamRecorder files and reading them back."""
+import logging
+
+from betfair.recorder import StreamRecorder, read_recording
+from betfair.replay import merge_recordings
+from betfair.stream_pool import StreamConnection
+
+
+def record(directory, payloads):
+    recorder = StreamRecorder(str(directory))
+    for i, payload in enumerate(payloads):
+        recorder.record(payload, received=1000. + i / 1000)
+    return recorder
+
+
+def test_closed_recording_reads_back(tmp_path):
+    payloads = [f'{{"op": "mcm", "pt": {i}}}' for i in range(100)]
+    recorder = record(tmp_path, payloads)
+    recorder.close()
+    assert list(read_recording(recorder.filename)) == [(1000. + i / 1000, payload) for i, payload in enumerate(payloads)]
+
+
+def test_reads_up_to_a_truncated_gzip_member(tmp_path, caplog):
+    payloads = [f'{{"op": "mcm", "pt": {i}, "pad": "{"x" * (i % 50)}"}}' for i in range(5000)]
+    recorder = record(tmp_path, payloads)
+    recorder.close()
+    with open(recorder.filename, 'rb') as f:
+        data = f.read()
+    with open(recorder.filename, 'wb') as f:
+        f.write(data[:len(data) // 2])
+
+    with caplog.at_level(logging.WARNING, logger='betfair.recorder'):
+        records = list(read_recording(recorder.filename))
+    assert 0 < len(records) < len(payloads)
+    assert records == [(1000. + i / 1000, payload) for i, payload in enumerate(payloads[:len(records)])]
+    assert 'truncated' in caplog.text
+
+
+class Listener:
+    race_ids = frozenset()
+    session = None
+
+    def reset_clk(self):
+        pass
+
+
+def test_stopping_the_connection_closes_the_recording(tmp_path):
+    listener = Listener()
+    listener.recorder = record(tmp_path, ['{"op": "mcm", "pt": 1}', '{"op": "mcm", "pt": 2}'])
+    StreamConnection('a', None, listener, {}).stop()
+    assert list(read_recording(listener.recorder.filename)) == [(1000., '{"op": "mcm", "pt": 1}'),
+                                                                (1000.001, '{"op": "mcm", "pt": 2}')]
+
+
+def test_each_connection_records_its_own_files(tmp_path):
+    listeners = [Listener(), Listener()]
+    for listener in listeners:
+        listener.recorder = StreamRecorder(str(tmp_path))
+    connections = [StreamConnection(str(i), None, listener, {}) for i, listener in enumerate(listeners)]
+    for connection in connections:
+        connection.listener.recorder.record('{"op": "mcm"}', received=1000.)
+        connection.stop()
+    assert sorted(path.name.split('_')[0] for path in tmp_path.iterdir()) == ['stream-0', 'stream-1']
+
+
+def test_replay_merges_connections_on_receive_time(tmp_path):
+    paths = []
+    for name, times in (('stream-0', (1., 4., 5.)), ('stream-1', (2., 3., 6.))):
+        recorder = StreamRecorder(str(tmp_path), prefix=name)
+        for received in times:
+            recorder.record(f'{{"pt": {received}}}', received=1000. + received)
+        recorder.close()
+        paths.append(recorder.filename)
+    assert [received - 1000. for received, _ in merge_recordings(paths)] == [1., 2., 3., 4., 5., 6.]
@@ -0,0 +1,57 @@
+"""RollingWindow against a deque of the same samples with full scans."""
+import random
+from collections import deque
+
+import pytest
+
+from betfair.rolling import RollingWindow
+
+
+def reference_window(samples, maxlen, max_age):
+    window = deque(maxlen=maxlen)
+    for value, timestamp in samples:
+        window.append((value, timestamp))
+        if max_age is not None:
+            while len(window) > 1 and window[0][1] < timestamp - max_age:
+                window.popleft()
+    return [value for value, _ in window]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_full_scans(seed):
+    rng = random.Random(seed)
+    maxlen = rng.randint(1, 50)
+    max_age = rng.choice([None, 1., 5.])
+    window = RollingWindow(maxlen=maxlen, max_age=max_age)
+    samples = []
+    timestamp = 0.
+    for _ in range(rng.randint(1, 500)):
+        timestamp += rng.random()
+        value = rng.choice([0., rng.uniform(1.01, 1000), rng.choice([2., 3.5, 10.])])
+        samples.append((value, timestamp))
+        window.append(value, timestamp)
+        expected = reference_window(samples, maxlen, max_age)
+        assert list(window) == expected
+        assert window.mean == pytest.approx(sum(expected) / len(expected))
+        assert window.min == min(expected)
+        assert window.max == max(expected)
+        assert window.last == expected[-1]
+
+
+def test_expire_keeps_newest_sample():
+    window = RollingWindow(maxlen=10, max_age=1.)
+    window.append(2., 0.)
+    window.append(3., 0.5)
+    window.expire(100.)
+    assert list(window) == [3.]
+
+
+def test_empty_window():
+    window = RollingWindow(maxlen=3)
+    assert len(window) == 0
+    assert (window.mean, window.min, window.max, window.last) == (0., 0., 0., 0.)
+
+
+def test_maxlen_must_be_positive():
+    with pytest.raises(ValueError):
+        RollingWindow(maxlen=0)
@@ -0,0 +1,120 @@
+"""SessionManager logins, keep alive and renewal after authentication errors, with a fake client."""
+import asyncio
+import threading
+import time
+
+import pytest
+from betfairlightweight.exceptions import APIError
+
+from betfair.session import SessionManager, api_error_code, is_auth_error
+
+
+def api_error(code, exception='APINGException'):
+    return APIError({'error': {'code': -32099, 'data': {'exceptionname': exception, exception: {'errorCode': code}}}},
+                    'SportsAPING/v1.0/listMarketBook')
+
+
+class Client:
+    def __init__(self, login_seconds=0., keep_alive_fails=False):
+        self.session_token = None
+        self.session_expired = False
+        self.login_seconds = login_seconds
+        self.keep_alive_fails = keep_alive_fails
+        self.logins = 0
+        self._lock = threading.Lock()
+
+    def login_interactive(self):
+        time.sleep(self.login_seconds)
+        with self._lock:
+            self.logins += 1
+            self.session_token = f'token-{self.logins}'
+
+    def keep_alive(self):
+        if self.keep_alive_fails:
+            raise api_error('NO_SESSION', 'AccountAPINGException')
+
+
+def test_error_codes():
+    assert api_error_code(api_error('INVALID_SESSION_INFORMATION')) == 'INVALID_SESSION_INFORMATION'
+    assert api_error_code(api_error('NO_SESSION', 'AccountAPINGException')) == 'NO_SESSION'
+    assert api_error_code(APIError(None, 'method')) is None
+    assert api_error_code(ValueError()) is None
+    assert is_auth_error(api_error('NOT_AUTHORIZED'))
+    assert not is_auth_error(api_error('TOO_MUCH_DATA'))
+
+
+def test_concurrent_ensure_logs_in_once():
+    client = Client(login_seconds=.1)
+    sessions = SessionManager(client)
+
+    async def main():
+        await asyncio.gather(sessions.ensure(), sessions.ensure(), sessions.ensure())
+
+    asyncio.run(main())
+    assert client.logins == 1
+    assert sessions.stats['logins'] == 1
+    assert client.session_token == 'token-1'
+
+
+def test_ensure_keeps_a_valid_session():
+    client = Client()
+    sessions = SessionManager(client)
+    asyncio.run(sessions.ensure())
+    asyncio.run(sessions.ensure())
+    assert client.logins == 1
+    client.session_expired = True
+    asyncio.run(sessions.ensure())
+    assert client.logins == 2
+
+
+def test_call_renews_a_rejected_session_once():
+    client = Client()
+    sessions = SessionManager(client)
+    sessions.login()
+    tokens = []
+
+    def endpoint():
+        tokens.append(client.session_token)
+        if client.session_token == 'token-1':
+            raise api_error('INVALID_SESSION_INFORMATION')
+        return 'book'
+
+    assert sessions.call(endpoint) == 'book'
+    assert tokens == ['token-1', 'token-2']
+    assert sessions.stats['auth_failures'] == 1
+
+
+def test_call_raises_other_errors_without_login():
+    client = Client()
+    sessions = SessionManager(client)
+    sessions.login()
+
+    def endpoint():
+        raise api_error('TOO_MUCH_DATA')
+
+    with pytest.raises(APIError):
+        sessions.call(endpoint)
+    assert client.logins == 1
+
+
+def test_concurrent_auth_failures_share_one_login():
+    client = Client(login_seconds=.05)
+    sessions = SessionManager(client)
+    sessions.login()
+    token = client.session_token
+    threads = [threading.Thread(target=sessions.on_auth_failure, args=(token,)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.logins == 2
+    assert sessions.stats['auth_failures'] == 5
+
+
+def test_failed_keep_alive_logs_in_again():
+    client = Client(keep_alive_fails=True)
+    sessions = SessionManager(client)
+    sessions.login()
+    sessions.keep_alive()
+    assert client.logins == 2
+    assert sessions.stats['keep_alive_failures'] == 1
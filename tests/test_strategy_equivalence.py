@@ -0,0 +1,62 @@
+"""
+Orders and status comments of the strategy engine against the pandas
+implementation the NumPy evaluation replaced.
+
+data/strategy_reference.json was recorded by running the scenarios of
+strategy_scenarios.py through the pandas engine (commit 08e176a).
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from betfair import strategy
+from betfair.streamer import HorseRaceListener
+
+from strategy_scenarios import build_scenario, order_key
+
+with open(os.path.join(os.path.dirname(__file__), 'data', 'strategy_reference.json')) as f:
+    REFERENCE = json.load(f)
+
+
+def run_scenario(seed, monkeypatch):
+    scenario = build_scenario(seed)
+    now = datetime.now(pytz.utc)
+    race_dict = {}
+    for market_id, race in scenario['races'].items():
+        race = dict(race)
+        race['start_time'] = now + timedelta(seconds=race.pop('start_offset'))
+        race_dict[market_id] = race
+    placed = []
+
+    async def insert_order(order):
+        placed.append(order)
+
+    monkeypatch.setattr(strategy, 'insert_order', insert_order)
+    ff = {}
+    listener = HorseRaceListener(ff, frozenset(race_dict), race_dict, {}, scenario['horse_info'],
+                                 scenario['runnerid_name'])
+    handler = strategy.StrategyHandler()
+    publish_time = int(now.timestamp() * 1000)
+    for market_changes in scenario['steps']:
+        for market_change in market_changes:
+            listener.on_data(json.dumps({'op': 'mcm', 'pt': publish_time, 'mc': [market_change]}))
+        asyncio.run(handler.check_execute(ff, race_dict, scenario['runnerid_name'], scenario['strategies'],
+                                          listener.snapshots))
+    return {'orders': sorted((order_key(order) for order in placed), key=lambda order: json.dumps(order, sort_keys=True)),
+            'strategy_status': {market_id: dict(ff[market_id].strategy_status) for market_id in race_dict},
+            'runner_status': {market_id: {runner.runner_id: ff[market_id].runner_status.get(runner.runner_id)
+                                          for runner in ff[market_id].runners}
+                              for market_id in race_dict}}
+
+
+@pytest.mark.parametrize('seed', sorted(REFERENCE, key=int))
+def test_matches_pandas_engine(seed, monkeypatch):
+    result = json.loads(json.dumps(run_scenario(int(seed), monkeypatch), sort_keys=True))
+    expected = REFERENCE[seed]
+    assert result['orders'] == expected['orders']
+    assert result['strategy_status'] == expected['strategy_status']
+    assert result['runner_status'] == expected['runner_status']
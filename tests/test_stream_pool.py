@@ -0,0 +1,44 @@
+"""StreamConnection stats samples."""
+import time
+
+from betfair.decoder import StreamDecoder
+from betfair.stream_pool import StreamConnection
+
+
+class Listener:
+    race_ids = frozenset()
+    messages_processed = 0
+    last_lag = .1
+    max_lag = .5
+    session = None
+    recorder = None
+
+
+def test_stats_leave_the_sample_alone():
+    connection = StreamConnection('a', None, Listener(), {})
+    time.sleep(.05)
+    connection.listener.messages_processed = 10
+    first, second = connection.stats(), connection.stats()
+    assert first['messages_per_second'] > 0
+    assert second['messages_per_second'] > 0
+    assert first['max_lag'] == second['max_lag'] == .5
+
+
+def test_start_sample_resets_rate_and_max_lag():
+    connection = StreamConnection('a', None, Listener(), {})
+    connection.listener.messages_processed = 10
+    connection.start_sample()
+    stats = connection.stats()
+    assert stats['messages_per_second'] == 0
+    assert stats['max_lag'] == 0
+    assert stats['messages'] == 10
+
+
+def test_markets_leaving_the_connection_are_dropped_from_the_decoder():
+    listener = Listener()
+    listener.decoder = StreamDecoder()
+    connection = StreamConnection('a', None, listener, {})
+    connection.market_ids = frozenset(('1.1', '1.2'))
+    listener.decoder.decode('{"op": "mcm", "mc": [{"id": "1.1", "rc": [{"id": 1}]}, {"id": "1.2"}, {"id": "1.3"}]}')
+    connection.restrict({'1.2'})
+    assert set(listener.decoder._market_slots) == {'1.2'}
@@ -0,0 +1,55 @@
+"""TickDataWriter batching and the drop and block policies of a full queue."""
+import threading
+import time
+
+from betfair.tickwriter import TickDataWriter
+
+
+class Collection:
+    def __init__(self):
+        self.batches = []
+
+    def insert_many(self, rows, ordered=True):
+        self.batches.append(list(rows))
+
+
+def test_stop_writes_queued_rows_in_batches():
+    collection = Collection()
+    writer = TickDataWriter(collection, batch_size=4, flush_interval=.05)
+    for i in range(10):
+        assert writer.put({'i': i})
+    writer.start()
+    writer.stop(timeout=5)
+    assert [row['i'] for batch in collection.batches for row in batch] == list(range(10))
+    assert max(map(len, collection.batches)) == 4
+    assert writer.stats()['written'] == 10
+
+
+def test_drop_policy_discards_rows_of_a_full_queue():
+    collection = Collection()
+    writer = TickDataWriter(collection, queue_size=3, policy='drop')
+    results = [writer.put({'i': i}) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert (writer.queued, writer.dropped) == (3, 2)
+
+    writer.start()
+    writer.stop(timeout=5)
+    assert [row['i'] for batch in collection.batches for row in batch] == [0, 1, 2]
+
+
+def test_block_policy_waits_for_the_writer():
+    collection = Collection()
+    writer = TickDataWriter(collection, queue_size=2, batch_size=1, flush_interval=.01, policy='block')
+    writer.put({'i': 0})
+    writer.put({'i': 1})
+    blocked = threading.Thread(target=writer.put, args=({'i': 2},), daemon=True)
+    blocked.start()
+    time.sleep(.1)
+    assert blocked.is_alive()  # the queue is full until the writer runs
+
+    writer.start()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    writer.stop(timeout=5)
+    assert [row['i'] for batch in collection.batches for row in batch] == [0, 1, 2]
+    assert (writer.queued, writer.dropped) == (3, 0)
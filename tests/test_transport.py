@@ -0,0 +1,226 @@
+"""RequestBudget grants and BetfairTransport coalescing, limits and timeouts, with a fake client and over HTTP."""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from betfairlightweight import APIClient
+from betfairlightweight.exceptions import APIError
+
+from betfair.session import SessionManager
+from betfair.transport import (DEFAULT_WEIGHT, PRIORITY_ANALYTICS, PRIORITY_DATA, PRIORITY_ORDERS, BetfairTransport,
+                               RequestBudget, request_weight)
+
+
+class Betting:
+    def __init__(self, seconds=.05, error=None):
+        self.seconds = seconds
+        self.error = error
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.sessions = set()
+        self._lock = threading.Lock()
+
+    def list_market_book(self, market_ids, session=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.sessions.add(id(session))
+        try:
+            time.sleep(self.seconds)
+            if self.error is not None:
+                raise self.error
+            return [{'marketId': market_id} for market_id in market_ids]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class Client:
+    session_token = 'token'
+    session_expired = False
+
+    def __init__(self, **kwargs):
+        self.betting = Betting(**kwargs)
+
+
+def transport(client, **kwargs):
+    return BetfairTransport(client, SessionManager(client), threads=4, **kwargs)
+
+
+def test_request_weight():
+    assert request_weight('betting.list_market_book', {'market_ids': ['1.1', '1.2']}) == 10
+    assert request_weight('betting.list_market_catalogue', {'max_results': 200}) == 200
+    assert request_weight('account.get_account_funds', {}) == DEFAULT_WEIGHT
+
+
+def test_budget_grants_by_priority():
+    async def main():
+        budget = RequestBudget(rate=100, burst=10)
+        await budget.acquire(10, PRIORITY_DATA)  # empties the bucket
+        granted = []
+
+        async def request(name, priority):
+            await budget.acquire(5, priority)
+            granted.append(name)
+
+        analytics = asyncio.ensure_future(request('analytics', PRIORITY_ANALYTICS))
+        await asyncio.sleep(0)
+        data = asyncio.ensure_future(request('data', PRIORITY_DATA))
+        await asyncio.sleep(0)
+        started = time.perf_counter()
+        await budget.acquire(10, PRIORITY_ORDERS)  # never waits, goes into debt
+        order_wait = time.perf_counter() - started
+        await asyncio.gather(analytics, data)
+        return granted, order_wait, time.perf_counter() - started, budget.stats
+
+    granted, order_wait, waited, stats = asyncio.run(main())
+    assert granted == ['data', 'analytics']
+    assert order_wait < .01
+    # the debt of the order is paid back before the waiting requests get their weight: (10 + 5 + 5) / 100 s
+    assert waited >= .19
+    assert stats['waited'] == 2
+
+
+def test_budget_caps_weight_at_burst():
+    async def main():
+        budget = RequestBudget(rate=1000, burst=10)
+        started = time.perf_counter()
+        await budget.acquire(500, PRIORITY_DATA)
+        return time.perf_counter() - started, budget.tokens
+
+    waited, tokens = asyncio.run(main())
+    assert waited < .05
+    assert tokens == pytest.approx(0, abs=1)
+
+
+def test_identical_requests_share_one_call():
+    client = Client()
+
+    async def main():
+        rest = transport(client)
+        return await asyncio.gather(*[rest.request('betting.list_market_book', market_ids=['1.1']) for _ in range(5)]), rest
+
+    results, rest = asyncio.run(main())
+    assert client.betting.calls == 1
+    assert results == [[{'marketId': '1.1'}]] * 5
+    assert rest.stats['betting.list_market_book']['coalesced'] == 4
+    assert rest._in_flight == {}
+
+
+def test_cancelled_caller_leaves_shared_call_running():
+    client = Client(seconds=.1)
+
+    async def main():
+        rest = transport(client)
+        first = asyncio.ensure_future(rest.request('betting.list_market_book', market_ids=['1.1']))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(rest.request('betting.list_market_book', market_ids=['1.1']))
+        await asyncio.sleep(.02)
+        first.cancel()
+        return first, await second
+
+    first, second = asyncio.run(main())
+    assert first.cancelled()
+    assert second == [{'marketId': '1.1'}]
+    assert client.betting.calls == 1
+
+
+def test_errors_reach_every_caller():
+    client = Client(error=ValueError('bad request'))
+
+    async def main():
+        rest = transport(client)
+        return await asyncio.gather(*[rest.request('betting.list_market_book', market_ids=['1.1']) for _ in range(3)],
+                                    return_exceptions=True), rest
+
+    results, rest = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert rest.stats['betting.list_market_book']['errors'] == 1
+
+
+def test_concurrency_limit_and_pooled_sessions():
+    client = Client(seconds=.05)
+
+    async def main():
+        rest = transport(client, concurrency={'betting.list_market_book': 2})
+        await asyncio.gather(*[rest.request('betting.list_market_book', market_ids=[f'1.{i}']) for i in range(6)])
+
+    asyncio.run(main())
+    assert client.betting.calls == 6
+    assert client.betting.max_in_flight == 2
+    assert len(client.betting.sessions) <= 4
+
+
+def test_timeout():
+    client = Client(seconds=.5)
+
+    async def main():
+        rest = transport(client, timeouts={'betting.list_market_book': .05})
+        with pytest.raises(asyncio.TimeoutError):
+            await rest.request('betting.list_market_book', market_ids=['1.1'])
+        return rest
+
+    rest = asyncio.run(main())
+    assert rest.stats['betting.list_market_book']['timeouts'] == 1
+
+
+class BettingHandler(BaseHTTPRequestHandler):
+    """JSON-RPC listMarketBook, sleeping for market ids starting with 'slow'."""
+    protocol_version = 'HTTP/1.1'  # keep-alive, so pooled sessions reuse their connections
+
+    def do_POST(self):
+        rpc = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append((self.client_address, self.headers['X-Authentication'], rpc['method']))
+        market_ids = rpc['params']['marketIds']
+        if market_ids[0].startswith('slow'):
+            time.sleep(.5)
+        body = json.dumps({'jsonrpc': '2.0', 'id': rpc['id'],
+                           'result': [{'marketId': market_id} for market_id in market_ids]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BettingHandler)
+    server.daemon_threads = True
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_pooled_sessions_over_http(api_server):
+    client = APIClient('user', 'password', app_key='app', lightweight=True)
+    client.api_uri = f'http://127.0.0.1:{api_server.server_port}/'
+    client.set_session_token('token')
+    client.betting.read_timeout = .2
+
+    async def main():
+        rest = transport(client)
+        books = await asyncio.gather(*[rest.request('betting.list_market_book', market_ids=[f'1.{i % 8}'])
+                                       for i in range(40)])
+        with pytest.raises(APIError):  # the client's read timeout, inside the transport's own
+            await rest.request('betting.list_market_book', market_ids=['slow'])
+        return rest, books
+
+    rest, books = asyncio.run(main())
+    assert [book[0]['marketId'] for book in books] == [f'1.{i % 8}' for i in range(40)]
+    requests = [request for request in api_server.requests if request[2] == 'SportsAPING/v1.0/listMarketBook']
+    assert {token for _, token, _ in requests} == {'token'}
+    # 4 threads with one keep-alive session each, never a connection per call
+    assert len({address for address, _, _ in requests}) <= 4 < len(requests)
+    assert rest.stats['betting.list_market_book']['errors'] == 1
@@ -0,0 +1,108 @@
+"""MarketTrigger wake ups from stream threads, full passes and window events."""
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+
+from betfair.clock import MarketClock
+from betfair.trigger import MarketTrigger
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+
+def test_first_wait_is_a_full_pass():
+    async def main():
+        trigger = MarketTrigger(MarketClock(), max_wait=60)
+        return await trigger.wait()
+
+    assert run(main()) is None
+
+
+def test_mark_from_thread_returns_dirty_markets():
+    async def main():
+        trigger = MarketTrigger(MarketClock(), max_wait=60, min_interval=0)
+        await trigger.wait()
+        threading.Timer(.05, lambda: [trigger.mark('1.1'), trigger.mark('1.2')]).start()
+        started = time.perf_counter()
+        dirty = await trigger.wait()
+        return dirty, time.perf_counter() - started, trigger.stats
+
+    dirty, waited, stats = run(main())
+    assert dirty == {'1.1', '1.2'}
+    assert waited < 1
+    assert stats['markets_evaluated'] == 2
+
+
+def test_mark_all_and_max_wait_give_full_passes():
+    async def main():
+        trigger = MarketTrigger(MarketClock(), max_wait=.2, min_interval=0)
+        await trigger.wait()
+        trigger.mark_all()
+        after_mark_all = await trigger.wait()
+        started = time.perf_counter()
+        after_max_wait = await trigger.wait()
+        return after_mark_all, after_max_wait, time.perf_counter() - started
+
+    after_mark_all, after_max_wait, waited = run(main())
+    assert after_mark_all is None
+    assert after_max_wait is None
+    assert .15 < waited < 1
+
+
+def test_window_event_marks_market():
+    async def main():
+        clock = MarketClock()
+        trigger = MarketTrigger(clock, max_wait=60, min_interval=0)
+        await trigger.wait()
+        now = time.time()
+        race = {'start_time': datetime.fromtimestamp(now + 60.2, timezone.utc), 'event_type': {'name': 'Horse Racing'},
+                'market_type': 'WIN', 'fullTitle': 'R1 Flat', 'event': {'countryCode': 'AU'}}
+        strategies = {'s': {'active': 'on', 'selectedCountries': ['AU'], 'secsToStartSlider': [-60, 10]}}
+        # the timer is added while wait() already sleeps
+        asyncio.get_running_loop().call_later(.05, clock.update, {'1.1': race}, strategies, ['1.1'])
+        started = time.time()
+        dirty = await trigger.wait()
+        return dirty, time.time() - started
+
+    dirty, waited = run(main())
+    assert dirty == {'1.1'}
+    assert waited < 1
+
+
+def test_busy_stream_does_not_starve_the_event_loop():
+    """Markets marked during every pass must not keep other tasks from running."""
+    async def main():
+        trigger = MarketTrigger(MarketClock(), max_wait=60, min_interval=.01)
+        stop = threading.Event()
+
+        def stream():
+            i = 0
+            while not stop.is_set():
+                trigger.mark(f'1.{i % 5}')
+                i += 1
+                time.sleep(.001)
+
+        async def engine():
+            while True:
+                await trigger.wait()
+                time.sleep(.015)  # a synchronous strategy pass
+
+        engine_task = asyncio.ensure_future(engine())
+        await asyncio.sleep(0)
+        thread = threading.Thread(target=stream)
+        thread.start()
+        try:
+            started = time.perf_counter()
+            await asyncio.sleep(.2)
+            return time.perf_counter() - started, trigger.stats['wakeups']
+        finally:
+            stop.set()
+            thread.join()
+            engine_task.cancel()
+
+    slept, wakeups = run(main())
+    assert slept < 1
+    # passes are at least min_interval apart, marks in between are collected
+    assert 1 < wakeups < .2 / .01 + 3
@@ -0,0 +1,80 @@
+"""TradedVolume totals and recent volume, from deltas and full images."""
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from betfair.orderbook import TICK_PRICES
+from betfair.snapshot import SnapshotStore
+from betfair.streamer import HorseRaceListener
+from betfair.volume import TradedVolume
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_matches_dict_of_sizes(seed):
+    rng = random.Random(seed)
+    prices = rng.sample(TICK_PRICES, 10)
+    volume = TradedVolume(recent_seconds=60)
+    sizes = {}
+    increases = []
+    now = 0.
+    for _ in range(200):
+        now += rng.choice([.5, 5, 40])
+        levels = [[price, sizes.get(price, 0) + rng.choice([0, 0, rng.randint(1, 100)])]
+                  for price in rng.sample(prices, rng.randint(1, 3))]
+        for price, size in levels:
+            if size > sizes.get(price, 0):
+                increases.append((now, size - sizes.get(price, 0)))
+            sizes[price] = size
+        volume.update(levels, now)
+        total = sum(sizes.values())
+        assert volume.total == pytest.approx(total)
+        assert volume.recent_volume == pytest.approx(sum(size for when, size in increases if when >= now - 60))
+        if total:
+            assert volume.vwap == pytest.approx(sum(price * size for price, size in sizes.items()) / total)
+
+
+def test_image_repeating_the_sizes_adds_no_recent_volume():
+    volume = TradedVolume(recent_seconds=60)
+    volume.update([[2.0, 1000], [2.02, 510]], 0.)
+    volume.expire(120.)
+    volume.replace([[2.0, 1000], [2.02, 510]], 120.)
+    assert volume.total == 1510
+    assert volume.recent_volume == 0
+
+
+def test_image_counts_only_what_it_adds():
+    volume = TradedVolume(recent_seconds=60)
+    volume.update([[2.0, 1000]], 0.)
+    volume.replace([[2.0, 1200], [3.0, 50]], 10.)
+    assert volume.total == 1250
+    assert volume.recent_volume == 1000 + 200 + 50
+    volume.expire(65.)
+    assert volume.recent_volume == 250
+
+
+def test_image_drops_prices_it_leaves_out():
+    volume = TradedVolume()
+    volume.update([[2.0, 100], [3.0, 50]], 0.)
+    volume.replace([[2.0, 100]], 1.)
+    assert volume.total == 100
+    assert volume.size_at(3.0) == 0
+    assert volume.vwap == 2.0
+
+
+def test_resent_image_keeps_recent_volume_in_the_listener():
+    now = datetime.now(pytz.utc)
+    race_dict = {'1.1': {'start_time': now + timedelta(minutes=5), 'fullTitle': 'Race 1', 'market_type': 'WIN'}}
+    snapshots = SnapshotStore()
+    listener = HorseRaceListener({}, frozenset({'1.1'}), race_dict, {}, {}, {1: '1. Alpha'}, snapshots)
+    runner = {'id': 1, 'atb': [[2.0, 10]], 'trd': [[2.0, 1000], [2.02, 510]]}
+    published = int(now.timestamp() * 1000)
+    listener.on_data(json.dumps({'op': 'mcm', 'pt': published, 'mc': [{'id': '1.1', 'img': True, 'rc': [runner]}]}))
+    # reconnect two minutes later, nothing traded meanwhile
+    listener.on_data(json.dumps({'op': 'mcm', 'pt': published + 120000,
+                                 'mc': [{'id': '1.1', 'img': True, 'rc': [runner]}]}))
+    state = snapshots.get('1.1').runners['1']
+    assert state['volume'] == 1510
+    assert state['recent_volume'] == 0
@@ -7,6 +7,15 @@ export const DATA_ATTRIBUTES = [
     "Last Traded price",
     "Current lay price",
     "Current back price",
+    "Traded volume",
+    "Recent traded volume",
+    "Traded VWAP",
+    "Weight of money",
+    "Microprice",
+    "Spread ticks",
+    "Depth imbalance",
+    "Back VWAP",
+    "Lay VWAP",
     "Last total odds",
     "Back total odds",
     "Lay total odds",